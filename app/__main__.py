@@ -1,29 +1,46 @@
-import calendar
+import argparse
 import logging
-from datetime import datetime, timedelta  # noqa
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta  # noqa
 from enum import Enum
-from operator import attrgetter
-
-from httpx import Client
-
-from app.clinics_card.entities import Patient, Plan
+from functools import partial
+from typing import Iterable, Iterator
+
+from app.calendar_layout import DATE_ROW, HEADER_ROWS, PaymentCalendar
+from app.clinics_card.base import ClinicsCardTransport
+from app.clinics_card.decoding import FAST_DECODING_AVAILABLE
+from app.clinics_card.entities import Patient
+from app.clinics_card.fetch import run_requests
 from app.clinics_card.invoices import ClinicsCardInvoice
 from app.clinics_card.patients import ClinicsCardPatient
 from app.clinics_card.payments import ClinicsCardPayment
 from app.clinics_card.plans import ClinicsCardPlan
 from app.clinics_card.visits import ClinicsCardVisit
 from app.config import settings
+from app.daemon import RunLock, SyncDaemon, create_schedule
 from app.excel import GoogleSheetsClient
+from app.metrics import metrics
+from app.patient_index import PatientCodeIndex
+from app.pipeline import BackgroundFlusher, run_pipeline
+from app.profiling import DEFAULT_PROFILE_DIR, profiler
+from app.revenue import RevenueEngine, RevenueSummary
+from app.sheet_writer import SheetWritePlanner
+from app.storage import SnapshotStore
+from app.sync import SyncState
+from app.worksheets import open_local_worksheet
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-PAYMENT_DATE_INDEXES: dict[datetime, tuple[int, int]] = {}
+HISTORY_START_DATE = "2023-01-01"
 # CURRENT_DATE = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)  # noqa
 CURRENT_DATE = datetime(year=2025, month=5, day=1)  # noqa
 
 
 class ColumnElementId(Enum):
+    CODE = 4
     TREATMENT_PLAN = 11
     VISITS_COUNT = 7
     FIRST_VISIT_DATE = 8
@@ -60,116 +77,126 @@ def get_month_name(date: datetime) -> str:
     return MONTH_NAMES_RU[date.month - 1]
 
 
-def days_in_half_year_up_to(year, half, up_to_month, up_to_day):
-    start_month = 1 if half == 1 else 7
-
-    total_days = 0
-    for month in range(start_month, up_to_month + 1):
-        days_in_month = calendar.monthrange(year, month)[1] + 1
-        if month == up_to_month:
-            if up_to_day >= days_in_month:
-                raise ValueError("Указанный день превышает количество дней в месяце.")
-            total_days += up_to_day + 1
-        else:
-            total_days += days_in_month
-
-    return total_days
-
-
-def get_half_year(target_date: datetime) -> int:
-    half = 1 if target_date.month <= 6 else 2
-    return half
-
-
-def get_half_year_str(target_date: datetime) -> str:
-    year = target_date.year
-    half = 1 if target_date.month <= 6 else 2
-    return f"{half} полугодие {year}"
-
-
-def get_payment_date_position(date: datetime, google_sheet_client: GoogleSheetsClient):
-    global PAYMENT_DATE_INDEXES
-
-    if date not in PAYMENT_DATE_INDEXES:
-        half = get_half_year(date)
-        half_str = get_half_year_str(date)
-        half_str_position = google_sheet_client.find(half_str)
-        d_index = days_in_half_year_up_to(date.year, half, date.month, date.day)
-        payment_date_position = (half_str_position[0] + d_index - 1, 3)
-        PAYMENT_DATE_INDEXES[date] = payment_date_position
-
-    return PAYMENT_DATE_INDEXES[date]
+def get_payment_date_position(date: datetime, payment_calendar: PaymentCalendar) -> tuple[int, int]:
+    return payment_calendar.get_column(date), DATE_ROW
 
 
-def get_all_patient_data() -> list[Patient]:
-    patient_client = ClinicsCardPatient(
-        http_client=Client(base_url="https://cliniccards.com/api"),
-        api_key=settings.CLINICS_CARD_API_KEY,
+def create_clinics_card_transport() -> ClinicsCardTransport:
+    return ClinicsCardTransport(
+        base_url=settings.CLINICS_CARD_BASE_URL,
+        max_connections=settings.CLINICS_CARD_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.CLINICS_CARD_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.CLINICS_CARD_KEEPALIVE_EXPIRY,
+        timeout=settings.CLINICS_CARD_TIMEOUT,
+        connect_timeout=settings.CLINICS_CARD_CONNECT_TIMEOUT,
+        http2=settings.CLINICS_CARD_HTTP2,
     )
-    visits_client = ClinicsCardVisit(
-        http_client=Client(base_url="https://cliniccards.com/api"),
-        api_key=settings.CLINICS_CARD_API_KEY,
-    )
-    payment_client = ClinicsCardPayment(
-        http_client=Client(base_url="https://cliniccards.com/api"),
-        api_key=settings.CLINICS_CARD_API_KEY,
-    )
-    plans_client = ClinicsCardPlan(
-        http_client=Client(base_url="https://cliniccards.com/api"),
-        api_key=settings.CLINICS_CARD_API_KEY,
-    )
-    invoices_client = ClinicsCardInvoice(
-        http_client=Client(base_url="https://cliniccards.com/api"),
-        api_key=settings.CLINICS_CARD_API_KEY,
-    )
-
-    patients = patient_client.get_all_patients()
-    visits = visits_client.get_visits_by_period(date_from="2023-01-01", date_to=get_current_date_iso_string())
-    payments = payment_client.get_payments_by_period(date_from="2023-01-01", date_to=get_current_date_iso_string())
-    plans = plans_client.get_plans_by_period(date_from="2023-01-01", date_to=get_current_date_iso_string())
-    invoices = invoices_client.get_invoices_by_period(date_from="2023-01-01", date_to=get_current_date_iso_string())
-
-    plan_map: dict[str, Plan] = {plan.id: plan for plan in plans}
 
-    patient_map: dict[str, Patient] = {}
 
-    for patient in patients:
-        patient.main_plans = plan_map.get(patient.main_plans_id)
-        patient_map[patient.id] = patient
-
-    for visit in visits:
-        if visit.patient_id not in patient_map:
-            logger.warning("Patient %s does not exist", visit.patient_id)
-            continue
+def fetch_clinics_card_data(
+    transport: ClinicsCardTransport,
+    concurrent: bool = True,
+    date_from: dict[str, str] | None = None,
+    date_to: str | None = None,
+    streaming: bool = False,
+) -> dict[str, Iterable]:
+    """Загружает данные всех эндпоинтов.
+
+    В потоковом режиме возвращает генераторы, которые нужно прочитать до закрытия transport.
+    """
+    fast_decoding = settings.CLINICS_CARD_FAST_DECODING
+    if fast_decoding and not FAST_DECODING_AVAILABLE:
+        logger.warning(
+            "Package msgspec is not installed, falling back to standard JSON decoding (poetry install -E fast)"
+        )
+        fast_decoding = False
+
+    client_options = {
+        "http_client": transport.client,
+        "api_key": settings.CLINICS_CARD_API_KEY,
+        "fast_decoding": fast_decoding,
+    }
+    period_options = {
+        **client_options,
+        "window": None if settings.CLINICS_CARD_FETCH_WINDOW == "none" else settings.CLINICS_CARD_FETCH_WINDOW,
+        "max_workers": settings.CLINICS_CARD_FETCH_WORKERS,
+    }
+
+    patient_client = ClinicsCardPatient(**client_options)
+    visits_client = ClinicsCardVisit(**period_options)
+    payment_client = ClinicsCardPayment(**period_options)
+    plans_client = ClinicsCardPlan(**period_options)
+    invoices_client = ClinicsCardInvoice(**period_options)
+
+    date_from = date_from or {}
+    date_to = date_to or get_current_date_iso_string()
+
+    def period(endpoint: str) -> dict[str, str]:
+        return {"date_from": date_from.get(endpoint, HISTORY_START_DATE), "date_to": date_to}
+
+    if streaming:
+        return {
+            "patients": patient_client.iter_all_patients(),
+            "visits": visits_client.iter_visits_by_period(**period("visits")),
+            "payments": payment_client.iter_payments_by_period(**period("payments")),
+            "plans": plans_client.iter_plans_by_period(**period("plans")),
+            "invoices": invoices_client.iter_invoices_by_period(**period("invoices")),
+        }
+
+    return run_requests(
+        {
+            "patients": patient_client.get_all_patients,
+            "visits": partial(visits_client.get_visits_by_period, **period("visits")),
+            "payments": partial(payment_client.get_payments_by_period, **period("payments")),
+            "plans": partial(plans_client.get_plans_by_period, **period("plans")),
+            "invoices": partial(invoices_client.get_invoices_by_period, **period("invoices")),
+        },
+        concurrent=concurrent,
+    )
 
-        patient_map[visit.patient_id].visits.append(visit)
 
-    for payment in payments:
-        if payment.patient_id not in patient_map:
-            logger.warning("Patient %s does not exist", payment.patient_id)
-            continue
+def create_google_sheet_client() -> GoogleSheetsClient:
+    worksheet = None
+    if settings.GOOGLE_WORKSHEET_BACKEND == "local":
+        worksheet = open_local_worksheet(
+            path=settings.GOOGLE_LOCAL_WORKSHEET_PATH,
+            max_requests=settings.GOOGLE_RATE_LIMIT_REQUESTS,
+            per_seconds=settings.GOOGLE_RATE_LIMIT_PERIOD,
+        )
 
-        patient_map[payment.patient_id].payments.append(payment)
+    return GoogleSheetsClient(
+        google_sheets_key=settings.GOOGLE_SPREADSHEET_KEY,
+        worksheet_name=settings.GOOGLE_WORKSHEET_NAME,
+        token_path="data/token.json",
+        max_requests=settings.GOOGLE_RATE_LIMIT_REQUESTS,
+        per_seconds=settings.GOOGLE_RATE_LIMIT_PERIOD,
+        burst=settings.GOOGLE_RATE_LIMIT_BURST,
+        cache_max_size=settings.GOOGLE_CACHE_MAX_SIZE,
+        cache_ttl=settings.GOOGLE_CACHE_TTL,
+        worksheet=worksheet,
+    )
 
-    for invoice in invoices:
-        if invoice.patient_id not in patient_map:
-            logger.warning("Patient %s does not exist", invoice.patient_id)
-            continue
 
-        patient_map[invoice.patient_id].invoices.append(invoice)
+def get_all_patient_data(store: SnapshotStore) -> Iterator[Patient]:
+    with profiler.phase("fetch"), metrics.span("fetch"), create_clinics_card_transport() as transport:
+        data = fetch_clinics_card_data(
+            transport=transport,
+            concurrent=settings.CLINICS_CARD_CONCURRENT_FETCH,
+            streaming=settings.CLINICS_CARD_STREAMING,
+        )
 
-    patients = patient_map.values()
-    patients = filter(lambda x: x.first_visit_date is not None, patients)
-    patients = sorted(patients, key=attrgetter("first_visit_date"))
+        with store.transaction():
+            for table, entities in data.items():
+                store.replace(table, entities)
 
-    return patients
+    return store.iter_patients()
 
 
 def get_inisert_patient_values(patient: Patient):
     full_name = f"{patient.last_name} {patient.first_name}"
-    first_doctor = patient.visits[0].doctor if patient.visits else ""
-    treatment_plan = patient.main_plans.plan_total_with_discount if patient.main_plans else ""
-    treatment_plan = int(float(treatment_plan)) if treatment_plan else 0
+    aggregates = patient.aggregates
+    first_doctor = aggregates.first_doctor if aggregates.first_doctor is not None else ""
+    treatment_plan = aggregates.treatment_plan if aggregates.treatment_plan is not None else 0
 
     return [
         "",
@@ -178,7 +205,7 @@ def get_inisert_patient_values(patient: Patient):
         patient.code,
         patient.curator,
         first_doctor,
-        patient.visits_count,
+        aggregates.visits_count,
         patient.first_visit_date,
         "",
         "",
@@ -186,14 +213,12 @@ def get_inisert_patient_values(patient: Patient):
     ]
 
 
-def update_patient_data(patient: Patient, google_sheet_client: GoogleSheetsClient):
+def update_patient_data(patient: Patient, write_planner: SheetWritePlanner):
     full_name = f"{patient.last_name} {patient.first_name}"
 
-    treatment_plan = patient.main_plans.plan_total_with_discount if patient.main_plans else ""
-    treatment_plan = int(float(treatment_plan)) if treatment_plan else ""
-
-    visits_count = len([visit for visit in patient.visits if visit.status == "VISITED"])
-    visits_count = visits_count if visits_count else ""
+    aggregates = patient.aggregates
+    treatment_plan = aggregates.treatment_plan if aggregates.treatment_plan is not None else ""
+    visits_count = aggregates.visits_count if aggregates.visits_count else ""
 
     updates = [
         (patient.row_position, ColumnElementId.FULL_NAME.value, full_name),
@@ -202,19 +227,23 @@ def update_patient_data(patient: Patient, google_sheet_client: GoogleSheetsClien
         (patient.row_position, ColumnElementId.FIRST_VISIT_DATE.value, patient.first_visit_date),
     ]
 
-    google_sheet_client.update_cells(updates)
+    write_planner.add(updates)
 
     logger.info("Updated patient %s: treatment plan=%s, visits count=%s", patient.code, treatment_plan, visits_count)
 
 
-def update_patient_invoices(patient: Patient, google_sheet_client: GoogleSheetsClient):
+def update_patient_invoices(
+    patient: Patient,
+    payment_calendar: PaymentCalendar,
+    write_planner: SheetWritePlanner,
+):
     patient_invoice_sums = get_patient_invoice_sums_grouped_by_datetime(patient=patient)
     updates = []
     dates_and_sums = []
 
     for patient_invoice_date_created, invoice_sum in patient_invoice_sums.items():
         invoice_date_position = get_payment_date_position(
-            patient_invoice_date_created, google_sheet_client=google_sheet_client
+            patient_invoice_date_created, payment_calendar=payment_calendar
         )
 
         patient_invoice_date_position = (patient.row_position, invoice_date_position[0])
@@ -231,7 +260,7 @@ def update_patient_invoices(patient: Patient, google_sheet_client: GoogleSheetsC
         )
 
     if updates:
-        google_sheet_client.update_cells(updates)
+        write_planner.add(updates)
         for date_created, invoice_sum, position in dates_and_sums:
             logger.info(
                 "Insert patient %s invoice %s by the date: %s at the position: %s",
@@ -244,57 +273,29 @@ def update_patient_invoices(patient: Patient, google_sheet_client: GoogleSheetsC
 
 def set_patient_row_position(
     patient: Patient,
-    google_sheet_client: GoogleSheetsClient,
+    patient_index: PatientCodeIndex,
 ) -> bool:
-    is_patient_exist = False
-    try:
-        patient.row_position = google_sheet_client.find(patient.code, in_column=4)[1]
-
-        is_patient_exist = True
-    except ValueError:
-        patient.row_position = None
-
-    return is_patient_exist
+    patient.row_position = patient_index.find_row(patient.code)
+    return patient.row_position is not None
 
 
-def insert_new_patient(patient: Patient, google_sheet_client: GoogleSheetsClient):
+def insert_new_patient(patient: Patient, patient_index: PatientCodeIndex, write_planner: SheetWritePlanner):
     inser_patint_values = get_inisert_patient_values(patient=patient)
-    last_row = google_sheet_client.get_last_row()
-    google_sheet_client.write_row(inser_patint_values, position=last_row + 1)
-    logger.info("Insert new patient %s values %s", patient.code, inser_patint_values)
+    # Новый пациент встает сразу за ближайшим меньшим кодом, соседние вставки уходят одним запросом
+    before_row = patient_index.get_insert_row(patient.code)
+    patient.row_position = write_planner.insert_row(inser_patint_values, before_row=before_row, order=patient.code)
+    patient_index.add(patient.code, row=patient.row_position, insert_row=before_row)
+    logger.info("Insert new patient %s before row %s values %s", patient.code, before_row, inser_patint_values)
 
 
 def get_patient_invoice_sums_grouped_by_datetime(patient: Patient) -> dict[datetime, int]:
-    patient_invoice_sums: dict[datetime, int] = {}
-
-    for invoice in patient.invoices:
-
-        if invoice.date_created < CURRENT_DATE:
-            continue
-
-        if invoice.date_created not in patient_invoice_sums:
-            patient_invoice_sums[invoice.date_created] = 0
+    current_date_ordinal = CURRENT_DATE.toordinal()
 
-        patient_invoice_sums[invoice.date_created] += int(float(invoice.amount))
-
-    return patient_invoice_sums
-
-
-def insert_patient_payment_count(
-    patient: Patient,
-    patients_payments_count_grouped_by_date: dict[datetime, list[Patient]],
-):
-    for invoce in patient.invoices:
-        if invoce.date_created < CURRENT_DATE:
-            continue
-
-        if invoce.date_created not in patients_payments_count_grouped_by_date:
-            patients_payments_count_grouped_by_date[invoce.date_created] = []
-
-        if patient not in patients_payments_count_grouped_by_date[invoce.date_created]:
-            patients_payments_count_grouped_by_date[invoce.date_created].append(patient)
-
-            logger.debug("Added patient payment count to patient: %s", patient.code)
+    return {
+        datetime.fromordinal(date_ordinal): invoice_sum
+        for date_ordinal, invoice_sum in patient.aggregates.invoice_sums.items()
+        if date_ordinal >= current_date_ordinal
+    }
 
 
 def get_payment_count_position(
@@ -308,100 +309,319 @@ def get_payment_count_position(
 
 
 def update_patients_payments_count(
-    patients_payments_count_grouped_by_date: dict[datetime, list[Patient]],
-    google_sheet_client: GoogleSheetsClient,
+    revenue_summary: RevenueSummary,
+    payment_calendar: PaymentCalendar,
+    write_planner: SheetWritePlanner,
 ):
     updates = []
-    for payment_count_date, patients in patients_payments_count_grouped_by_date.items():
-        payments_count = len(patients)
+    for payment_count_ordinal, payments_count in revenue_summary.paying_patients_by_day.items():
+        payment_count_date = datetime.fromordinal(payment_count_ordinal)
 
-        payment_count_position = get_payment_date_position(
-            date=payment_count_date, google_sheet_client=google_sheet_client
-        )
+        payment_count_position = get_payment_date_position(date=payment_count_date, payment_calendar=payment_calendar)
         row = RowElementId.MONTH_COUNT.value
         col = payment_count_position[0]
 
         updates.append((row, col, payments_count))
 
     if updates:
-        google_sheet_client.update_cells(updates)
+        write_planner.add(updates)
 
         for row, col, count in updates:
             logger.info("Inserted %s payments count at position row=%s, col=%s", count, row, col)
 
 
-def get_nearest_lover_patient_by_id(patients: list[Patient], target_id: int) -> Patient | None:
-    if not patients:
-        return None
+@dataclass
+class SheetSyncContext:
+    """Все, что нужно для записи пациентов в лист за один запуск"""
+
+    google_sheet_client: GoogleSheetsClient
+    payment_calendar: PaymentCalendar
+    patient_index: PatientCodeIndex
+    write_planner: SheetWritePlanner
+    revenue_engine: RevenueEngine
+    changed_patient_ids: set[str] | None = None
+
+
+def prepare_sheet_sync(
+    google_sheet_client: GoogleSheetsClient | None = None,
+    changed_patient_ids: set[str] | None = None,
+) -> SheetSyncContext:
+    with metrics.span("sheet_read"):
+        google_sheet_client = google_sheet_client or create_google_sheet_client()
+        # Снимок читается заново в каждом запуске: строки листа могли вставить или удалить вручную
+        google_sheet_client.load_snapshot()
+        payment_calendar = PaymentCalendar.load_or_build(
+            path=settings.PAYMENT_CALENDAR_PATH,
+            header_rows=google_sheet_client.get_header_rows(HEADER_ROWS),
+        )
+        patient_index = PatientCodeIndex(google_sheet_client.get_column_values(ColumnElementId.CODE.value))
+
+    return SheetSyncContext(
+        google_sheet_client=google_sheet_client,
+        payment_calendar=payment_calendar,
+        patient_index=patient_index,
+        write_planner=SheetWritePlanner(
+            google_sheet_client=google_sheet_client,
+            max_cells_per_request=settings.GOOGLE_BATCH_MAX_CELLS,
+        ),
+        revenue_engine=RevenueEngine(date_from=CURRENT_DATE.date(), use_numpy=settings.REVENUE_USE_NUMPY),
+        changed_patient_ids=changed_patient_ids,
+    )
+
 
-    sorted_patients = sorted(patients, key=lambda x: x.code)
+def sync_patient(context: SheetSyncContext, patient: Patient):
+    if patient.visits_count == 0:
+        logger.info("Patient %s has no visits", patient.code)
+        return
 
-    if target_id <= sorted_patients[0].code:
-        return None
+    if context.changed_patient_ids is not None and str(patient.id) not in context.changed_patient_ids:
+        # Количество оплативших за день считается по всем пациентам, а не только по измененным
+        with metrics.span("count"):
+            context.revenue_engine.add_patient(patient)
+        return
 
-    nearest_patient = None
-    for patient in sorted_patients:
-        if patient.code < target_id:
-            nearest_patient = patient
+    with metrics.span("position_lookup"):
+        is_patient_exist = set_patient_row_position(patient=patient, patient_index=context.patient_index)
+
+    with metrics.span("write"):
+        if not is_patient_exist:
+            insert_new_patient(
+                patient=patient, patient_index=context.patient_index, write_planner=context.write_planner
+            )
         else:
-            break
+            update_patient_data(patient=patient, write_planner=context.write_planner)
 
-    return nearest_patient
+        update_patient_invoices(
+            patient=patient,
+            payment_calendar=context.payment_calendar,
+            write_planner=context.write_planner,
+        )
 
+    with metrics.span("count"):
+        context.revenue_engine.add_patient(patient)
 
-def inser_not_exist_patients_excel(patients: list[Patient]):
-    google_sheet_client = GoogleSheetsClient(
-        google_sheets_key=settings.GOOGLE_SPREADSHEET_KEY,
-        worksheet_name=settings.GOOGLE_WORKSHEET_NAME,
-        token_path="data/token.json",
-    )
 
-    patients_payments_count_grouped_by_date: dict[datetime, list[Patient]] = {}
-    previous_patients = []
+def finish_sheet_sync(context: SheetSyncContext):
+    with metrics.span("count"):
+        revenue_summary = context.revenue_engine.compute()
+        context.revenue_engine.log_rollups(revenue_summary)
 
-    for patient in patients:
-        if patient.visits_count == 0:
-            logger.info("Patient %s has no visits", patient.code)
-            continue
+        update_patients_payments_count(
+            revenue_summary=revenue_summary,
+            payment_calendar=context.payment_calendar,
+            write_planner=context.write_planner,
+        )
 
-        is_patient_exist = set_patient_row_position(
-            patient=patient,
-            google_sheet_client=google_sheet_client,
+    with metrics.span("flush"):
+        context.write_planner.flush()
+
+    logger.info("Google Sheets rate limiter: %s", context.google_sheet_client.rate_limiter.metrics)
+    logger.info("Google Sheets cache: %s", context.google_sheet_client.cache_metrics)
+
+
+def inser_not_exist_patients_excel(
+    patients: Iterable[Patient],
+    changed_patient_ids: set[str] | None = None,
+    google_sheet_client: GoogleSheetsClient | None = None,
+):
+    context = prepare_sheet_sync(google_sheet_client=google_sheet_client, changed_patient_ids=changed_patient_ids)
+
+    # Сборка пациентов из снимка ленивая, поэтому время join учитывается при получении каждого пациента
+    for patient in metrics.timed_iter("join", patients):
+        sync_patient(context, patient)
+
+    finish_sheet_sync(context)
+
+
+def fetch_incremental_changes(
+    store: SnapshotStore,
+    transport: ClinicsCardTransport | None = None,
+    full: bool = False,
+) -> set[str] | None:
+    """Догружает изменения с последней синхронизации и возвращает id измененных пациентов (None - все).
+
+    С full или раз в SYNC_FULL_RECONCILE_DAYS загружается вся история и снимок сверяется с ClinicsCard целиком.
+    """
+    sync_state = SyncState(store)
+    date_to = get_current_date_iso_string()
+    full = full or sync_state.is_full_sync_due(
+        date.fromisoformat(date_to), every_days=settings.SYNC_FULL_RECONCILE_DAYS
+    )
+    date_from = sync_state.get_date_from(
+        default=HISTORY_START_DATE,
+        lookback_days=settings.SYNC_LOOKBACK_DAYS,
+        mutable_lookback_days=settings.SYNC_MUTABLE_LOOKBACK_DAYS,
+        full=full,
+    )
+
+    # Переданный транспорт принадлежит вызывающему и здесь не закрывается
+    transport_context = nullcontext(transport) if transport is not None else create_clinics_card_transport()
+    with profiler.phase("fetch"), metrics.span("fetch"), transport_context as transport:
+        data = fetch_clinics_card_data(
+            transport=transport,
+            concurrent=settings.CLINICS_CARD_CONCURRENT_FETCH,
+            date_from=date_from,
+            date_to=date_to,
+            streaming=settings.CLINICS_CARD_STREAMING,
         )
 
-        if not is_patient_exist:
-            insert_new_patient(patient=patient, google_sheet_client=google_sheet_client)
-            set_patient_row_position(patient=patient, google_sheet_client=google_sheet_client)
+        # Без сохраненного снимка обрабатываем всех пациентов
+        is_first_sync = sync_state.is_empty
+        sync_state.merge(data, date_from=date_from, date_to=date_to, full=full)
+
+    return None if is_first_sync else store.get_dirty_patient_ids()
+
+
+def run_incremental_sync(store: SnapshotStore):
+    changed_patient_ids = fetch_incremental_changes(store)
+
+    with profiler.phase("sheet_sync"):
+        inser_not_exist_patients_excel(patients=store.iter_patients(), changed_patient_ids=changed_patient_ids)
+
+    # Пометки снимаем только после успешной записи в таблицу
+    with store.transaction():
+        store.clear_dirty_patients()
+
+
+def run_pipelined_sync(store: SnapshotStore):
+    """Конвейерный запуск: лист читается параллельно с загрузкой ClinicsCard, сборка пациентов и планирование
+    записей связаны ограниченной очередью, а накопленные изменения отправляются в фоне под общим лимитом"""
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="sheet-read") as executor:
+        sheet_sync = executor.submit(prepare_sheet_sync)
+
+        if settings.INCREMENTAL_SYNC:
+            changed_patient_ids = fetch_incremental_changes(store)
+            patients = store.iter_patients()
         else:
-            update_patient_data(patient=patient, google_sheet_client=google_sheet_client)
+            changed_patient_ids = None
+            patients = get_all_patient_data(store=store)
 
-        update_patient_invoices(patient=patient, google_sheet_client=google_sheet_client)
+        context = sheet_sync.result()
+    context.changed_patient_ids = changed_patient_ids
 
-        insert_patient_payment_count(
-            patient=patient,
-            patients_payments_count_grouped_by_date=patients_payments_count_grouped_by_date,
+    with profiler.phase("sheet_sync"):
+        flusher = BackgroundFlusher(
+            write_planner=context.write_planner,
+            min_cells=settings.PIPELINE_FLUSH_CELLS,
+            interval=settings.PIPELINE_FLUSH_INTERVAL,
         )
+        flusher.start()
+        try:
+            # Пациенты собираются из снимка в текущем потоке (соединение sqlite привязано к нему)
+            run_pipeline(
+                metrics.timed_iter("join", patients),
+                handle=partial(sync_patient, context),
+                queue_size=settings.PIPELINE_QUEUE_SIZE,
+                name="sheet-sync",
+            )
+        finally:
+            flusher.stop()
+
+        finish_sheet_sync(context)
+
+    if settings.INCREMENTAL_SYNC:
+        with store.transaction():
+            store.clear_dirty_patients()
+
+
+def run_daemon():
+    """Инкрементальные синхронизации по расписанию с прогретыми транспортом, клиентом листа и снимком ClinicsCard.
+
+    Лист перечитывается в каждом запуске, а каждый DAEMON_FULL_SYNC_EVERY запуск полностью сверяет снимок
+    с ClinicsCard, чтобы долгоживущий процесс не накапливал расхождений.
+    """
+    schedule = create_schedule(interval_seconds=settings.DAEMON_INTERVAL_SECONDS, cron=settings.DAEMON_CRON)
+
+    with SnapshotStore(settings.SNAPSHOT_DB_PATH) as store, create_clinics_card_transport() as transport:
+        google_sheet_client = create_google_sheet_client()
+        runs_since_full_sync = 0
+
+        def run_once():
+            nonlocal runs_since_full_sync
+            metrics.reset()
+            if profiler.enabled:
+                profiler.start_run()
+            full_sync = 0 < settings.DAEMON_FULL_SYNC_EVERY <= runs_since_full_sync
+            try:
+                changed_patient_ids = fetch_incremental_changes(store, transport=transport, full=full_sync)
+
+                context = prepare_sheet_sync(
+                    google_sheet_client=google_sheet_client,
+                    changed_patient_ids=changed_patient_ids,
+                )
+
+                with profiler.phase("sheet_sync"):
+                    for patient in metrics.timed_iter("join", store.iter_patients()):
+                        sync_patient(context, patient)
+                    finish_sheet_sync(context)
+
+                with store.transaction():
+                    store.clear_dirty_patients()
+                runs_since_full_sync = 0 if full_sync else runs_since_full_sync + 1
+            except Exception:
+                # После неудачной записи кеши клиента могут расходиться с листом
+                google_sheet_client.clear_cache()
+                raise
+            finally:
+                metrics.export(json_path=settings.METRICS_JSON_PATH, prometheus_path=settings.METRICS_PROMETHEUS_PATH)
+                profiler.report()
+
+        daemon = SyncDaemon(run_once=run_once, schedule=schedule, lock_path=settings.SYNC_LOCK_PATH)
+        daemon.install_signal_handlers()
+        daemon.run_forever()
 
-        previous_patients.append(patient)
 
-    update_patients_payments_count(
-        patients_payments_count_grouped_by_date=patients_payments_count_grouped_by_date,
-        google_sheet_client=google_sheet_client,
-    )
+def main():
+    with RunLock(settings.SYNC_LOCK_PATH) as acquired:
+        if not acquired:
+            logger.warning("Another sync is already running, exiting")
+            return
+        run_sync()
 
 
-def main():
-    patients = get_all_patient_data()
-    inser_not_exist_patients_excel(patients=patients)
+def run_sync():
+    try:
+        with SnapshotStore(settings.SNAPSHOT_DB_PATH) as store:
+            if settings.PIPELINE_MODE:
+                run_pipelined_sync(store=store)
+                return
+
+            if settings.INCREMENTAL_SYNC:
+                run_incremental_sync(store=store)
+                return
+
+            patients = get_all_patient_data(store=store)
+            with profiler.phase("sheet_sync"):
+                inser_not_exist_patients_excel(patients=patients)
+    finally:
+        # Метрики пишем и после ошибки, чтобы было видно, на какой фазе она случилась
+        metrics.export(json_path=settings.METRICS_JSON_PATH, prometheus_path=settings.METRICS_PROMETHEUS_PATH)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="app", description="Синхронизация пациентов ClinicsCard с Google Sheets")
+    parser.add_argument("--daemon", action="store_true", help="запускать инкрементальную синхронизацию по расписанию")
+    parser.add_argument("--profile", action="store_true", help="профилировать фазы запуска (cProfile и tracemalloc)")
+    parser.add_argument("--profile-dir", default=DEFAULT_PROFILE_DIR, help="каталог для pstats и сайтов аллокаций")
+    parser.add_argument("--profile-top", type=int, default=20, help="число строк в таблице горячих функций")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
+    args = parse_args()
+    if args.profile:
+        profiler.enable(output_dir=args.profile_dir, top=args.profile_top)
+
     logger.info("Strart...")
     try:
-        main()
+        if args.daemon:
+            run_daemon()
+        else:
+            main()
     except KeyboardInterrupt:
         pass
     except Exception as e:
         logger.error("Program raise global error: %s", repr(e))
 
+    profiler.report()
     logger.info("Program finish")
@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кеш с ограничением по размеру и времени жизни записей.
+
+    Старые записи вытесняются при переполнении, просроченные удаляются при обращении,
+    поэтому долгоживущий процесс не накапливает память.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float | None = 300):
+        if max_size <= 0:
+            raise ValueError("Cache max_size must be positive")
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and not self._is_expired(item[0])
+
+    def _is_expired(self, expires_at: float) -> bool:
+        return self.ttl is not None and expires_at <= time.monotonic()
+
+    def _expires_at(self) -> float:
+        return time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or self._is_expired(item[0]):
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (self._expires_at(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None or self._is_expired(item[0]):
+                return default
+            return item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def remap(self, func: Callable[[Hashable, Any], tuple[Hashable, Any] | None]):
+        """Перестраивает записи: func возвращает новую пару (ключ, значение) или None, чтобы удалить запись.
+
+        Порядок LRU и время жизни записей сохраняются.
+        """
+        with self._lock:
+            data = OrderedDict()
+            for key, (expires_at, value) in self._data.items():
+                if self._is_expired(expires_at):
+                    continue
+                item = func(key, value)
+                if item is not None:
+                    data[item[0]] = (expires_at, item[1])
+            self._data = data
+
+    @property
+    def metrics(self) -> dict[str, int]:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
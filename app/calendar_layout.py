@@ -0,0 +1,159 @@
+import calendar
+import hashlib
+import json
+import logging
+import os
+import re
+from datetime import date, timedelta
+
+from app.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Шапка листа: подписи полугодий и строка с датами
+HEADER_ROWS = 3
+DATE_ROW = 3
+
+HALF_YEAR_PATTERN = re.compile(r"^([12]) полугодие (\d{4})$")
+
+
+def days_in_half_year_up_to(year, half, up_to_month, up_to_day):
+    start_month = 1 if half == 1 else 7
+
+    total_days = 0
+    for month in range(start_month, up_to_month + 1):
+        days_in_month = calendar.monthrange(year, month)[1] + 1
+        if month == up_to_month:
+            if up_to_day >= days_in_month:
+                raise ValueError("Указанный день превышает количество дней в месяце.")
+            total_days += up_to_day + 1
+        else:
+            total_days += days_in_month
+
+    return total_days
+
+
+def get_half_year(target_date: date) -> int:
+    return 1 if target_date.month <= 6 else 2
+
+
+def get_half_year_str(target_date: date) -> str:
+    return f"{get_half_year(target_date)} полугодие {target_date.year}"
+
+
+def iter_half_year_dates(year: int, half: int):
+    current = date(year, 1 if half == 1 else 7, 1)
+    end = date(year, 7, 1) if half == 1 else date(year + 1, 1, 1)
+    while current < end:
+        yield current
+        current += timedelta(days=1)
+
+
+def get_header_signature(header_rows: list[list[str]]) -> str:
+    return hashlib.sha1(json.dumps(header_rows[:HEADER_ROWS], ensure_ascii=False).encode()).hexdigest()
+
+
+def is_date_header(value: str, target_date: date) -> bool:
+    return value.strip() in (
+        target_date.strftime("%d.%m"),
+        target_date.strftime("%d.%m.%Y"),
+        target_date.strftime("%d"),
+        str(target_date.day),
+    )
+
+
+class PaymentCalendar:
+    """Карта дата -> колонка сетки оплат, строится по шапке листа за один проход"""
+
+    def __init__(self, columns: dict[int, int], signature: str):
+        # Ключ - порядковый номер даты (date.toordinal())
+        self.columns = columns
+        self.signature = signature
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+    def get_column(self, target_date: date) -> int:
+        try:
+            return self.columns[target_date.toordinal()]
+        except KeyError:
+            raise ValueError(f"Value '{get_half_year_str(target_date)}' not found in the sheet") from None
+
+    @classmethod
+    def build(cls, header_rows: list[list[str]]) -> "PaymentCalendar":
+        columns = {}
+        for row_values in header_rows[:HEADER_ROWS]:
+            for col, value in enumerate(row_values, start=1):
+                match = HALF_YEAR_PATTERN.match(value.strip())
+                if match is None:
+                    continue
+
+                half, year = int(match.group(1)), int(match.group(2))
+                for target_date in iter_half_year_dates(year, half):
+                    d_index = days_in_half_year_up_to(year, half, target_date.month, target_date.day)
+                    columns.setdefault(target_date.toordinal(), col + d_index - 1)
+
+        calendar_layout = cls(columns=columns, signature=get_header_signature(header_rows))
+        calendar_layout.validate(header_rows)
+        return calendar_layout
+
+    def validate(self, header_rows: list[list[str]]):
+        """Сверяет каждую колонку с текстом строки дат.
+
+        Карту с расхождениями или пустыми ячейками дат использовать нельзя: суммы попали бы в чужие колонки.
+        """
+        if not self.columns:
+            raise ValueError("Payment calendar: no half-year headers found in the sheet header")
+
+        date_row = header_rows[DATE_ROW - 1] if len(header_rows) >= DATE_ROW else []
+        if not any(value.strip() for value in date_row):
+            raise ValueError(f"Payment calendar: date row {DATE_ROW} of the sheet header is empty")
+
+        mismatches = []
+        for date_ordinal, col in sorted(self.columns.items()):
+            value = date_row[col - 1] if col <= len(date_row) else ""
+            target_date = date.fromordinal(date_ordinal)
+            if not value or not is_date_header(value, target_date):
+                mismatches.append((target_date.isoformat(), col, value))
+
+        if mismatches:
+            raise ValueError(
+                f"Payment calendar: {len(mismatches)} of {len(self.columns)} columns do not match "
+                f"the date row, first: {mismatches[0]}"
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "PaymentCalendar | None":
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, encoding="utf-8") as file:
+                data = json.load(file)
+            columns = {date.fromisoformat(key).toordinal(): col for key, col in data["columns"].items()}
+            return cls(columns=columns, signature=data["signature"])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Payment calendar %s is broken, rebuilding: %s", path, repr(e))
+            return None
+
+    def save(self, path: str):
+        data = {
+            "signature": self.signature,
+            "columns": {date.fromordinal(key).isoformat(): col for key, col in sorted(self.columns.items())},
+        }
+        with atomic_write(path) as file:
+            json.dump(data, file, ensure_ascii=False)
+
+    @classmethod
+    def load_or_build(cls, path: str, header_rows: list[list[str]]) -> "PaymentCalendar":
+        """Берет сохраненную карту, если шапка листа не менялась, иначе строит и сохраняет новую"""
+        signature = get_header_signature(header_rows)
+        calendar_layout = cls.load(path)
+        if calendar_layout is not None and calendar_layout.signature == signature:
+            logger.info("Loaded payment calendar: %s dates", len(calendar_layout))
+            return calendar_layout
+
+        calendar_layout = cls.build(header_rows)
+        calendar_layout.save(path)
+        logger.info("Built payment calendar: %s dates", len(calendar_layout))
+        return calendar_layout
@@ -1,13 +1,226 @@
+import calendar
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterator, Literal, TypeVar
 
-from httpx import Client
+from httpx import Client, Limits, Response, Timeout
+
+from app.clinics_card.decoding import FAST_DECODERS
+from app.clinics_card.streaming import iter_json_array
+from app.metrics import instrument, metrics
+from app.utils import retry_request
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+FetchWindow = Literal["month", "week"]
+STREAM_PARSE_BATCH_SIZE = 1000
+
+
+def to_date(value: str | date | datetime) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value)
+
+
+def split_period(date_from: str | date, date_to: str | date, window: FetchWindow) -> list[tuple[date, date]]:
+    """Разбивает период на непересекающиеся окна (границы включительно) по месяцам или неделям"""
+    start, end = to_date(date_from), to_date(date_to)
+
+    windows = []
+    while start <= end:
+        if window == "month":
+            window_end = start.replace(day=calendar.monthrange(start.year, start.month)[1])
+        elif window == "week":
+            window_end = start + timedelta(days=6 - start.weekday())
+        else:
+            raise ValueError(f"Unknown fetch window '{window}'")
+
+        window_end = min(window_end, end)
+        windows.append((start, window_end))
+        start = window_end + timedelta(days=1)
+
+    return windows
+
+
+class ClinicsCardTransport:
+    """Общий HTTP клиент с пулом соединений для всех клиентов ClinicsCard"""
+
+    def __init__(
+        self,
+        base_url: str,
+        max_connections: int = 10,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 60.0,
+        connect_timeout: float = 10.0,
+        http2: bool = False,
+    ):
+        self.base_url = base_url
+        self.limits = Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        # Ожидание свободного соединения не ограничиваем: число одновременных запросов задают сами клиенты
+        self.timeout = Timeout(timeout, connect=connect_timeout, pool=None)
+        self.http2 = http2
+        self._client: Client | None = None
+
+    def _create_client(self) -> Client:
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("Package h2 is not installed, falling back to HTTP/1.1 (pip install 'httpx[http2]')")
+                http2 = False
+
+        return Client(base_url=self.base_url, limits=self.limits, timeout=self.timeout, http2=http2)
+
+    @property
+    def client(self) -> Client:
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_client()
+        return self._client
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def __enter__(self) -> "ClinicsCardTransport":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
 @dataclass
 class ClinicsCard:
     http_client: Client
     api_key: str
+    window: FetchWindow | None = None
+    max_workers: int = 4
+    fast_decoding: bool = False
 
     @property
     def headers(self):
         return {"Token": self.api_key, "Content-Type": "application/json"}
+
+    @instrument()
+    @retry_request()
+    def _get_data(self, url: str, params: dict | None = None) -> list[dict]:
+        response = self.http_client.get(url=url, headers=self.headers, params=params)
+        response.raise_for_status()
+        metrics.add_bytes(type(self).__name__, "_get_data", len(response.content))
+        return response.json()["data"]
+
+    @instrument()
+    @retry_request()
+    def _get_content(self, url: str, params: dict | None = None) -> bytes:
+        response = self.http_client.get(url=url, headers=self.headers, params=params)
+        response.raise_for_status()
+        metrics.add_bytes(type(self).__name__, "_get_content", len(response.content))
+        return response.content
+
+    def _get_entities(self, url: str, params: dict | None, parse: Callable[[list[dict]], list[T]]) -> list[T]:
+        decode = FAST_DECODERS.get(url) if self.fast_decoding else None
+        if decode is not None:
+            return decode(self._get_content(url=url, params=params))
+        return parse(self._get_data(url=url, params=params))
+
+    def _get_data_by_period(
+        self,
+        url: str,
+        date_from: str | datetime,
+        date_to: str | datetime,
+        parse: Callable[[list[dict]], list[T]],
+    ) -> list[T]:
+        if not self.window:
+            params = {"from": to_date(date_from).isoformat(), "to": to_date(date_to).isoformat()}
+            return self._get_entities(url=url, params=params, parse=parse)
+
+        def fetch_window(period: tuple[date, date]) -> list[T]:
+            params = {"from": period[0].isoformat(), "to": period[1].isoformat()}
+            return self._get_entities(url=url, params=params, parse=parse)
+
+        windows = split_period(date_from, date_to, window=self.window)
+
+        # Окна могут пересекаться на стороне API, поэтому убираем дубликаты по id
+        entities: dict[str, T] = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="clinics-card-window") as executor:
+            for chunk in executor.map(fetch_window, windows):
+                for entity in chunk:
+                    entities[entity.id] = entity
+
+        logger.debug("Fetched %s %s in %s windows", len(entities), url, len(windows))
+
+        return list(entities.values())
+
+    @retry_request()
+    def _open_stream(self, url: str, params: dict | None = None) -> Response:
+        request = self.http_client.build_request("GET", url=url, headers=self.headers, params=params)
+        response = self.http_client.send(request, stream=True)
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            raise
+        return response
+
+    @instrument()
+    def _iter_data(self, url: str, params: dict | None = None) -> Iterator[dict]:
+        """Потоково разбирает массив data ответа, не держа в памяти весь ответ.
+
+        Повторяется только открытие запроса: после первой отданной записи повтор дал бы дубликаты,
+        поэтому обрыв посреди ответа пробрасывается.
+        """
+        response = self._open_stream(url=url, params=params)
+        try:
+            yield from iter_json_array(self._count_bytes(response.iter_bytes(), "_iter_data"), key="data")
+        finally:
+            response.close()
+
+    def _count_bytes(self, chunks: Iterator[bytes], method: str) -> Iterator[bytes]:
+        component = type(self).__name__
+        for chunk in chunks:
+            metrics.add_bytes(component, method, len(chunk))
+            yield chunk
+
+    def _iter_parsed(self, raw_items: Iterator[dict], parse: Callable[[list[dict]], list[T]]) -> Iterator[T]:
+        batch = []
+        for raw_item in raw_items:
+            batch.append(raw_item)
+            if len(batch) >= STREAM_PARSE_BATCH_SIZE:
+                yield from parse(batch)
+                batch = []
+        if batch:
+            yield from parse(batch)
+
+    def _iter_data_by_period(
+        self,
+        url: str,
+        date_from: str | datetime,
+        date_to: str | datetime,
+        parse: Callable[[list[dict]], list[T]],
+    ) -> Iterator[T]:
+        """Потоковый вариант _get_data_by_period: окна загружаются по очереди, сущности отдаются по одной"""
+        if self.window:
+            windows = split_period(date_from, date_to, window=self.window)
+        else:
+            windows = [(to_date(date_from), to_date(date_to))]
+
+        # Для удаления дубликатов между окнами храним только id
+        seen_ids: set[str] = set()
+        for period in windows:
+            params = {"from": period[0].isoformat(), "to": period[1].isoformat()}
+            for entity in self._iter_parsed(self._iter_data(url=url, params=params), parse):
+                if entity.id in seen_ids:
+                    continue
+                seen_ids.add(entity.id)
+                yield entity
@@ -0,0 +1,108 @@
+"""Быстрое декодирование ответов ClinicsCard через msgspec (необязательная зависимость).
+
+Ответ декодируется сразу в типизированные структуры со слотами: даты и суммы разбираются один раз
+при чтении, без промежуточных словарей. Структуры повторяют атрибуты сущностей из entities.py,
+поэтому их можно сохранять в снимок наравне с обычными сущностями.
+"""
+
+from datetime import date, datetime
+from typing import Callable, Generic, TypeVar
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover
+    msgspec = None
+
+BAN_INVOICE_TYPES = ["PREINVOICE", "INSURANCE"]
+
+FAST_DECODING_AVAILABLE = msgspec is not None
+FAST_DECODERS: dict[str, Callable[[bytes], list]] = {}
+
+if msgspec is not None:
+    T = TypeVar("T")
+
+    class Response(msgspec.Struct, Generic[T], gc=False):
+        data: list[T]
+
+    class FastPatient(msgspec.Struct, gc=False):
+        id: int | str = msgspec.field(name="patient_id")
+        first_name: str | None = msgspec.field(name="firstname")
+        last_name: str | None = msgspec.field(name="lastname")
+        code: int
+        curator: str | None
+        first_visit_date: str | None
+        last_visit_date: str | None
+        main_plans_id: int | str | None
+
+    class FastPlan(msgspec.Struct, gc=False):
+        id: int | str = msgspec.field(name="plan_id")
+        name: str | None = msgspec.field(name="plan_name")
+        doctor_id: int | str | None
+        plan_total: float | None
+        plan_total_with_discount: float | None
+
+    class FastVisit(msgspec.Struct, gc=False):
+        id: int | str = msgspec.field(name="visit_id")
+        patient_id: int | str
+        status: str | None
+        doctor: str | None
+        date_created: str | None
+        visit_start: str | None
+        visit_end: str | None
+
+    class FastCashDesk(msgspec.Struct, gc=False):
+        currency: str | None = None
+        status: str | None = None
+
+    class FastPayment(msgspec.Struct, gc=False):
+        id: int | str = msgspec.field(name="payment_id")
+        patient_id: int | str
+        amount: float
+        type: str | None
+        date_created: datetime
+        cash_desk: FastCashDesk | None = None
+
+        def __post_init__(self):
+            self.date_created = self.date_created.replace(hour=0, minute=0, second=0, microsecond=0)
+
+        @property
+        def currency(self) -> str | None:
+            return self.cash_desk.currency if self.cash_desk is not None else None
+
+        @property
+        def status(self) -> str | None:
+            return self.cash_desk.status if self.cash_desk is not None else None
+
+    class FastInvoice(msgspec.Struct, gc=False):
+        id: int | str
+        patient_id: int | str
+        purpose: str | None
+        amount: float
+        # В ответе только дата, приводим к datetime как в обычных сущностях
+        date_created: date
+
+        def __post_init__(self):
+            self.date_created = datetime(self.date_created.year, self.date_created.month, self.date_created.day)
+
+    def _make_decoder(struct_type: type) -> Callable[[bytes], list]:
+        decoder = msgspec.json.Decoder(Response[struct_type], strict=False)
+
+        def decode(content: bytes) -> list:
+            return decoder.decode(content).data
+
+        return decode
+
+    _decode_invoices = _make_decoder(FastInvoice)
+
+    def decode_invoices(content: bytes) -> list:
+        return [invoice for invoice in _decode_invoices(content) if invoice.purpose not in BAN_INVOICE_TYPES]
+
+    FAST_DECODERS.update(
+        {
+            "/patients": _make_decoder(FastPatient),
+            "/plans": _make_decoder(FastPlan),
+            "/visits": _make_decoder(FastVisit),
+            "/payments": _make_decoder(FastPayment),
+            "/invoices": decode_invoices,
+        }
+    )
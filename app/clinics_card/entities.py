@@ -1,8 +1,21 @@
+from array import array
 from dataclasses import dataclass, field
-from datetime import datetime
+from datetime import date, datetime
 
 
-@dataclass
+def to_cents(amount: str | float | None) -> int:
+    return round(float(amount) * 100) if amount not in (None, "") else 0
+
+
+def to_ordinal(value: str | date | None) -> int:
+    if value is None or value == "":
+        return 0
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    return value.toordinal()
+
+
+@dataclass(slots=True)
 class Payment:
     id: str
     patient_id: str
@@ -16,7 +29,7 @@ class Payment:
         return int(self.id)
 
 
-@dataclass
+@dataclass(slots=True)
 class Plan:
     id: str
     name: str
@@ -25,7 +38,7 @@ class Plan:
     plan_total_with_discount: str
 
 
-@dataclass
+@dataclass(slots=True)
 class Visit:
     id: str
     patient_id: str
@@ -36,7 +49,7 @@ class Visit:
     visit_end: str | None
 
 
-@dataclass
+@dataclass(slots=True)
 class Invoice:
     id: str
     patient_id: str
@@ -45,7 +58,74 @@ class Invoice:
     purpose: str
 
 
-@dataclass
+@dataclass(slots=True)
+class InvoiceColumns:
+    """Счета пациента по колонкам: даты как ordinal, суммы в копейках"""
+
+    dates: array = field(default_factory=lambda: array("l"))
+    amounts: array = field(default_factory=lambda: array("q"))
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def append(self, date_created: date, amount: str | float):
+        self.dates.append(to_ordinal(date_created))
+        self.amounts.append(to_cents(amount))
+
+
+@dataclass(slots=True)
+class VisitColumns:
+    """Визиты пациента по колонкам: даты как ordinal, признак состоявшегося визита и врач"""
+
+    dates: array = field(default_factory=lambda: array("l"))
+    visited: array = field(default_factory=lambda: array("b"))
+    doctors: list[str] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def append(self, date_created: str | None, status: str, doctor: str):
+        self.dates.append(to_ordinal(date_created))
+        self.visited.append(status == "VISITED")
+        self.doctors.append(doctor)
+
+
+def get_treatment_plan(plan: Plan | None) -> int | None:
+    if plan is None or not plan.plan_total_with_discount:
+        return None
+    return int(float(plan.plan_total_with_discount))
+
+
+@dataclass(slots=True)
+class PatientAggregates:
+    """Показатели пациента, которые считаются один раз при объединении данных"""
+
+    visits_count: int = 0
+    # Врач первого визита независимо от его статуса, None - визитов нет
+    first_doctor: str | None = None
+    treatment_plan: int | None = None
+    # Сумма счетов по дням (ordinal даты), дробная часть каждого счета отбрасывается
+    invoice_sums: dict[int, int] = field(default_factory=dict)
+
+    def add_visit(self, visited: bool, doctor: str):
+        if self.first_doctor is None:
+            self.first_doctor = doctor or ""
+        self.visits_count += visited
+
+    def add_invoice(self, date_ordinal: int, amount_cents: int):
+        self.invoice_sums[date_ordinal] = self.invoice_sums.get(date_ordinal, 0) + int(amount_cents / 100)
+
+    @classmethod
+    def from_patient(cls, patient: "Patient") -> "PatientAggregates":
+        aggregates = cls(treatment_plan=get_treatment_plan(patient.main_plans))
+        for visited, doctor in zip(patient.visits.visited, patient.visits.doctors):
+            aggregates.add_visit(visited, doctor)
+        for date_ordinal, amount_cents in zip(patient.invoices.dates, patient.invoices.amounts):
+            aggregates.add_invoice(date_ordinal, amount_cents)
+        return aggregates
+
+
+@dataclass(slots=True)
 class Patient:
     id: str
     first_name: str
@@ -58,9 +138,20 @@ class Patient:
     row_position: int | None = field(default=None)
     main_plans: Plan | None = field(default=None)
     payments: list[Payment] = field(default_factory=list, kw_only=True)
-    visits: list[Visit] = field(default_factory=list, kw_only=True)
-    invoices: list[Invoice] = field(default_factory=list, kw_only=True)
+    visits: VisitColumns = field(default_factory=VisitColumns, kw_only=True)
+    invoices: InvoiceColumns = field(default_factory=InvoiceColumns, kw_only=True)
+    cached_aggregates: PatientAggregates | None = field(default=None, kw_only=True, repr=False, compare=False)
+
+    @property
+    def aggregates(self) -> PatientAggregates:
+        if self.cached_aggregates is None:
+            self.cached_aggregates = PatientAggregates.from_patient(self)
+        return self.cached_aggregates
+
+    def invalidate_aggregates(self):
+        """Сбрасывает посчитанные показатели после изменения визитов, счетов или плана"""
+        self.cached_aggregates = None
 
     @property
     def visits_count(self) -> int:
-        return len([visit for visit in self.visits if visit.status == "VISITED"])
+        return self.aggregates.visits_count
@@ -0,0 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+
+def run_requests(requests: dict[str, Callable[[], Any]], concurrent: bool = True) -> dict[str, Any]:
+    """Выполняет запросы к ClinicsCard последовательно или одновременно в пуле потоков"""
+    if not concurrent or len(requests) <= 1:
+        return {name: request() for name, request in requests.items()}
+
+    with ThreadPoolExecutor(max_workers=len(requests), thread_name_prefix="clinics-card") as executor:
+        futures = {name: executor.submit(request) for name, request in requests.items()}
+        return {name: future.result() for name, future in futures.items()}
@@ -1,10 +1,10 @@
 from datetime import datetime
+from typing import Iterator
 
 from app.clinics_card.base import ClinicsCard
+from app.clinics_card.decoding import BAN_INVOICE_TYPES
 from app.clinics_card.entities import Invoice
 
-BAN_INVOICE_TYPES = ["PREINVOICE", "INSURANCE"]
-
 
 class ClinicsCardInvoice(ClinicsCard):
 
@@ -21,21 +21,27 @@ class ClinicsCardInvoice(ClinicsCard):
 
         return amount
 
-    def get_invoices_by_period(self, date_from: str | datetime, date_to: str | datetime):
-        params = {"from": date_from, "to": date_to}
-        response = self.http_client.get(url="/invoices", headers=self.headers, params=params)
-        raw_invoices = response.json()["data"]
-
+    def _parse_invoices(self, raw_invoices: list[dict]) -> list[Invoice]:
         invoices = [
             Invoice(
                 id=raw_invoice["id"],
                 patient_id=str(raw_invoice["patient_id"]),
                 purpose=raw_invoice["purpose"],
                 amount=raw_invoice["amount"],
-                date_created=datetime.strptime(raw_invoice["date_created"], "%Y-%m-%d"),
+                date_created=datetime.fromisoformat(raw_invoice["date_created"]),
             )
             for raw_invoice in raw_invoices
             if raw_invoice["purpose"] not in BAN_INVOICE_TYPES
         ]
 
         return invoices
+
+    def get_invoices_by_period(self, date_from: str | datetime, date_to: str | datetime) -> list[Invoice]:
+        return self._get_data_by_period(
+            url="/invoices", date_from=date_from, date_to=date_to, parse=self._parse_invoices
+        )
+
+    def iter_invoices_by_period(self, date_from: str | datetime, date_to: str | datetime) -> Iterator[Invoice]:
+        return self._iter_data_by_period(
+            url="/invoices", date_from=date_from, date_to=date_to, parse=self._parse_invoices
+        )
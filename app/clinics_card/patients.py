@@ -1,13 +1,12 @@
+from typing import Iterator
+
 from app.clinics_card.base import ClinicsCard
 from app.clinics_card.entities import Patient
 
 
 class ClinicsCardPatient(ClinicsCard):
 
-    def get_all_patients(self) -> list[Patient]:
-        response = self.http_client.get(url="/patients", headers=self.headers)
-
-        raw_patients = response.json()["data"]
+    def _parse_patients(self, raw_patients: list[dict]) -> list[Patient]:
         data = [
             Patient(
                 id=raw_patient["patient_id"],
@@ -23,3 +22,9 @@ class ClinicsCardPatient(ClinicsCard):
         ]
 
         return data
+
+    def get_all_patients(self) -> list[Patient]:
+        return self._get_entities(url="/patients", params=None, parse=self._parse_patients)
+
+    def iter_all_patients(self) -> Iterator[Patient]:
+        return self._iter_parsed(self._iter_data(url="/patients"), parse=self._parse_patients)
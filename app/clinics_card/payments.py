@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Iterator
 
 from app.clinics_card.base import ClinicsCard
 from app.clinics_card.entities import Payment
@@ -6,18 +7,14 @@ from app.clinics_card.entities import Payment
 
 class ClinicsCardPayment(ClinicsCard):
 
-    def get_payments_by_period(self, date_from: str | datetime, date_to: str | datetime):
-        params = {"from": date_from, "to": date_to}
-        response = self.http_client.get(url="/payments", headers=self.headers, params=params)
-        raw_payments = response.json()["data"]
-
+    def _parse_payments(self, raw_payments: list[dict]) -> list[Payment]:
         payments = [
             Payment(
                 id=raw_payment["payment_id"],
                 patient_id=raw_payment["patient_id"],
                 amount=raw_payment["amount"],
                 type=raw_payment["type"],
-                date_created=datetime.strptime(raw_payment["date_created"], "%Y-%m-%d %H:%M:%S").replace(
+                date_created=datetime.fromisoformat(raw_payment["date_created"]).replace(
                     hour=0, minute=0, second=0, microsecond=0
                 ),
                 currency=(raw_payment["cash_desk"]["currency"] if raw_payment["cash_desk"] is not None else None),
@@ -27,3 +24,13 @@ class ClinicsCardPayment(ClinicsCard):
         ]
 
         return payments
+
+    def get_payments_by_period(self, date_from: str | datetime, date_to: str | datetime) -> list[Payment]:
+        return self._get_data_by_period(
+            url="/payments", date_from=date_from, date_to=date_to, parse=self._parse_payments
+        )
+
+    def iter_payments_by_period(self, date_from: str | datetime, date_to: str | datetime) -> Iterator[Payment]:
+        return self._iter_data_by_period(
+            url="/payments", date_from=date_from, date_to=date_to, parse=self._parse_payments
+        )
@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Iterator
 
 from app.clinics_card.base import ClinicsCard
 from app.clinics_card.entities import Plan
@@ -6,19 +7,21 @@ from app.clinics_card.entities import Plan
 
 class ClinicsCardPlan(ClinicsCard):
 
-    def get_plans_by_period(self, date_from: str | datetime, date_to: str | datetime):
-        params = {"from": date_from, "to": date_to}
-        response = self.http_client.get(url="/plans", headers=self.headers, params=params)
-        raw_payments = response.json()["data"]
-
-        payments = [
+    def _parse_plans(self, raw_plans: list[dict]) -> list[Plan]:
+        plans = [
             Plan(
-                id=raw_payment["plan_id"],
-                name=raw_payment["plan_name"],
-                doctor_id=raw_payment["doctor_id"],
-                plan_total=raw_payment["plan_total"],
-                plan_total_with_discount=raw_payment["plan_total_with_discount"],
+                id=raw_plan["plan_id"],
+                name=raw_plan["plan_name"],
+                doctor_id=raw_plan["doctor_id"],
+                plan_total=raw_plan["plan_total"],
+                plan_total_with_discount=raw_plan["plan_total_with_discount"],
             )
-            for raw_payment in raw_payments
+            for raw_plan in raw_plans
         ]
-        return payments
+        return plans
+
+    def get_plans_by_period(self, date_from: str | datetime, date_to: str | datetime) -> list[Plan]:
+        return self._get_data_by_period(url="/plans", date_from=date_from, date_to=date_to, parse=self._parse_plans)
+
+    def iter_plans_by_period(self, date_from: str | datetime, date_to: str | datetime) -> Iterator[Plan]:
+        return self._iter_data_by_period(url="/plans", date_from=date_from, date_to=date_to, parse=self._parse_plans)
@@ -0,0 +1,97 @@
+import codecs
+import json
+from typing import Any, Iterable, Iterator
+
+WHITESPACE = " \t\n\r"
+NUMBER_CHARS = "0123456789.eE+-"
+
+_decoder = json.JSONDecoder()
+
+
+class _Buffer:
+    """Текстовый буфер поверх потока байтов, который дочитывает данные по мере разбора"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self) -> bool:
+        if self.eof:
+            return False
+
+        for chunk in self._chunks:
+            text = self._utf8.decode(chunk)
+            if text:
+                # Отбрасываем уже разобранную часть, чтобы буфер не рос вместе с ответом
+                self.text = self.text[self.pos :] + text
+                self.pos = 0
+                return True
+
+        self.text = self.text[self.pos :] + self._utf8.decode(b"", final=True)
+        self.pos = 0
+        self.eof = True
+        return False
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.read_more():
+                raise ValueError("Unexpected end of JSON stream")
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at JSON stream position {self.pos}")
+        self.pos += 1
+
+    def decode_value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if not self.read_more():
+                    raise
+                continue
+
+            # Число в конце буфера может продолжаться в следующем чанке, в том числе после "." или "e"
+            if isinstance(value, (int, float)) and not self.text[end:].lstrip(NUMBER_CHARS) and self.read_more():
+                continue
+
+            self.pos = end
+            return value
+
+
+def iter_json_array(chunks: Iterable[bytes], key: str = "data") -> Iterator[Any]:
+    """Поэлементно разбирает массив по ключу верхнего уровня JSON объекта, не загружая ответ целиком"""
+    buffer = _Buffer(chunks)
+    buffer.expect("{")
+
+    while buffer.peek() != "}":
+        name = buffer.decode_value()
+        buffer.expect(":")
+
+        if name != key:
+            buffer.decode_value()
+        else:
+            buffer.expect("[")
+            if buffer.peek() == "]":
+                buffer.pos += 1
+            else:
+                while True:
+                    yield buffer.decode_value()
+                    if buffer.peek() == "]":
+                        buffer.pos += 1
+                        break
+                    buffer.expect(",")
+            return
+
+        if buffer.peek() == ",":
+            buffer.pos += 1
+
+    raise KeyError(key)
@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Iterator
 
 from app.clinics_card.base import ClinicsCard
 from app.clinics_card.entities import Visit
@@ -6,22 +7,23 @@ from app.clinics_card.entities import Visit
 
 class ClinicsCardVisit(ClinicsCard):
 
-    def get_visits_by_period(self, date_from: str | datetime, date_to: str | datetime):
-        params = {"from": date_from, "to": date_to}
-        response = self.http_client.get(url="/visits", headers=self.headers, params=params)
-
-        raw_payments = response.json()["data"]
-
-        payments = [
+    def _parse_visits(self, raw_visits: list[dict]) -> list[Visit]:
+        visits = [
             Visit(
-                id=raw_payment["visit_id"],
-                patient_id=raw_payment["patient_id"],
-                status=raw_payment["status"],
-                doctor=raw_payment["doctor"],
-                date_created=raw_payment["date_created"],
-                visit_start=raw_payment["visit_start"],
-                visit_end=raw_payment["visit_end"],
+                id=raw_visit["visit_id"],
+                patient_id=raw_visit["patient_id"],
+                status=raw_visit["status"],
+                doctor=raw_visit["doctor"],
+                date_created=raw_visit["date_created"],
+                visit_start=raw_visit["visit_start"],
+                visit_end=raw_visit["visit_end"],
             )
-            for raw_payment in raw_payments
+            for raw_visit in raw_visits
         ]
-        return payments
+        return visits
+
+    def get_visits_by_period(self, date_from: str | datetime, date_to: str | datetime) -> list[Visit]:
+        return self._get_data_by_period(url="/visits", date_from=date_from, date_to=date_to, parse=self._parse_visits)
+
+    def iter_visits_by_period(self, date_from: str | datetime, date_to: str | datetime) -> Iterator[Visit]:
+        return self._iter_data_by_period(url="/visits", date_from=date_from, date_to=date_to, parse=self._parse_visits)
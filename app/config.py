@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -5,9 +7,50 @@ class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env")
 
     CLINICS_CARD_API_KEY: str
+    CLINICS_CARD_BASE_URL: str = "https://cliniccards.com/api"
+    CLINICS_CARD_CONCURRENT_FETCH: bool = True
+    CLINICS_CARD_MAX_CONNECTIONS: int = 10
+    CLINICS_CARD_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    CLINICS_CARD_KEEPALIVE_EXPIRY: float = 30.0
+    CLINICS_CARD_TIMEOUT: float = 60.0
+    CLINICS_CARD_CONNECT_TIMEOUT: float = 10.0
+    CLINICS_CARD_HTTP2: bool = False
+    # "none" - весь период одним запросом
+    CLINICS_CARD_FETCH_WINDOW: Literal["month", "week", "none"] = "month"
+    CLINICS_CARD_FETCH_WORKERS: int = 4
+    CLINICS_CARD_STREAMING: bool = False
+    CLINICS_CARD_FAST_DECODING: bool = False
+
+    SNAPSHOT_DB_PATH: str = "data/snapshot.sqlite3"
+    METRICS_JSON_PATH: str | None = "data/metrics.json"
+    METRICS_PROMETHEUS_PATH: str | None = "data/metrics.prom"
+    PAYMENT_CALENDAR_PATH: str = "data/payment_calendar.json"
+    INCREMENTAL_SYNC: bool = False
+    SYNC_LOOKBACK_DAYS: int = 3
+    SYNC_MUTABLE_LOOKBACK_DAYS: int = 90
+    SYNC_FULL_RECONCILE_DAYS: int = 7
+
+    SYNC_LOCK_PATH: str = "data/sync.lock"
+    DAEMON_INTERVAL_SECONDS: float = 900
+    DAEMON_CRON: str | None = None
+    # Полная сверка снимка с ClinicsCard каждые N запусков демона, 0 - только по SYNC_FULL_RECONCILE_DAYS
+    DAEMON_FULL_SYNC_EVERY: int = 96
+    PIPELINE_MODE: bool = False
+    PIPELINE_QUEUE_SIZE: int = 1000
+    PIPELINE_FLUSH_CELLS: int = 5000
+    PIPELINE_FLUSH_INTERVAL: float = 5.0
+    REVENUE_USE_NUMPY: bool = True
 
     GOOGLE_SPREADSHEET_KEY: str
     GOOGLE_WORKSHEET_NAME: str
+    GOOGLE_WORKSHEET_BACKEND: Literal["google", "local"] = "google"
+    GOOGLE_LOCAL_WORKSHEET_PATH: str = "data/worksheet.json"
+    GOOGLE_CACHE_MAX_SIZE: int = 1024
+    GOOGLE_CACHE_TTL: float = 300
+    GOOGLE_BATCH_MAX_CELLS: int = 40000
+    GOOGLE_RATE_LIMIT_REQUESTS: int = 60
+    GOOGLE_RATE_LIMIT_PERIOD: float = 60
+    GOOGLE_RATE_LIMIT_BURST: int = 10
 
 
 settings = Settings()
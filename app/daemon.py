@@ -0,0 +1,232 @@
+import logging
+import os
+import signal
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Protocol
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class Schedule(Protocol):
+    def next_run(self, after: datetime) -> datetime: ...
+
+
+class IntervalSchedule:
+    def __init__(self, seconds: float):
+        if seconds <= 0:
+            raise ValueError("Interval must be positive")
+        self.seconds = seconds
+
+    def next_run(self, after: datetime) -> datetime:
+        return after + timedelta(seconds=self.seconds)
+
+    def __repr__(self) -> str:
+        return f"every {self.seconds:g}s"
+
+
+class CronSchedule:
+    """Расписание в формате cron из пяти полей: минута, час, день месяца, месяц, день недели.
+
+    Поддерживаются *, списки через запятую, диапазоны a-b и шаг /n. День недели 0-7, 0 и 7 - воскресенье.
+    Как и в cron, если ограничены и день месяца, и день недели, достаточно совпадения одного из них.
+    """
+
+    FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day", 1, 31), ("month", 1, 12), ("weekday", 0, 7))
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != len(self.FIELDS):
+            raise ValueError(f"Cron expression must have 5 fields: {expression!r}")
+
+        self.expression = expression
+        values = [self._parse_field(part, low, high) for part, (_, low, high) in zip(parts, self.FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = values
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        self.days_restricted = parts[2] != "*"
+        self.weekdays_restricted = parts[4] != "*"
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> set[int]:
+        values = set()
+        for part in field.split(","):
+            value_range, _, step = part.partition("/")
+            if value_range == "*":
+                start, end = low, high
+            elif "-" in value_range:
+                start, end = (int(value) for value in value_range.split("-", 1))
+            else:
+                start = int(value_range)
+                end = high if step else start
+
+            step = int(step) if step else 1
+            if not low <= start <= end <= high or step <= 0:
+                raise ValueError(f"Invalid cron field: {field!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_matches = moment.day in self.days
+        # В cron воскресенье - 0, у isoweekday - 7
+        weekday_matches = moment.isoweekday() % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day_matches or weekday_matches
+        return day_matches and weekday_matches
+
+    def next_run(self, after: datetime) -> datetime:
+        moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # Любое корректное расписание срабатывает хотя бы раз за несколько лет (29 февраля)
+        limit = moment + timedelta(days=366 * 8)
+        while moment < limit:
+            if moment.month not in self.months or not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f"Cron expression never fires: {self.expression!r}")
+
+    def __repr__(self) -> str:
+        return f"cron {self.expression!r}"
+
+
+def create_schedule(interval_seconds: float, cron: str | None = None) -> Schedule:
+    if cron:
+        return CronSchedule(cron)
+    return IntervalSchedule(interval_seconds)
+
+
+class RunLock:
+    """Межпроцессная блокировка запуска на файле, чтобы синхронизации не перекрывались.
+
+    Без fcntl (не POSIX системы) файл создается эксклюзивно и удаляется при освобождении,
+    после аварийного завершения его нужно удалить вручную.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def acquire(self) -> bool:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if fcntl is None:
+            return self._acquire_exclusive_file()
+
+        file = open(self.path, "a+")
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return False
+
+        file.seek(0)
+        file.truncate()
+        file.write(str(os.getpid()))
+        file.flush()
+        self._file = file
+        return True
+
+    def _acquire_exclusive_file(self) -> bool:
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            logger.warning("Lock file %s exists, remove it if no sync is running", self.path)
+            return False
+
+        self._file = os.fdopen(fd, "w")
+        self._file.write(str(os.getpid()))
+        self._file.flush()
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+
+        if fcntl is None:
+            self._file.close()
+            os.remove(self.path)
+        else:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+        self._file = None
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class SyncDaemon:
+    """Запускает синхронизацию по расписанию в одном процессе с прогретыми клиентами.
+
+    Запуски не перекрываются: следующий планируется только после завершения текущего,
+    а пропущенные за время долгого запуска слоты не догоняются. По SIGTERM/SIGINT текущий
+    запуск доводится до конца, после чего демон завершается; повторный сигнал прерывает его сразу.
+    """
+
+    def __init__(
+        self,
+        run_once: Callable[[], None],
+        schedule: Schedule,
+        lock_path: str,
+        run_on_start: bool = True,
+    ):
+        self.run_once = run_once
+        self.schedule = schedule
+        self.lock = RunLock(lock_path)
+        self.run_on_start = run_on_start
+        self.runs = 0
+        self.failures = 0
+        self._stop = threading.Event()
+
+    def request_stop(self, signum=None, frame=None):
+        if signum is not None:
+            logger.info("Received signal %s, stopping after the current run", signal.Signals(signum).name)
+            # Повторный сигнал обрабатывается по умолчанию и прерывает процесс
+            signal.signal(signum, signal.SIG_DFL)
+        self._stop.set()
+
+    def install_signal_handlers(self):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self.request_stop)
+
+    def _run(self):
+        if not self.lock.acquire():
+            logger.warning("Previous sync is still running in another process, skipping this run")
+            return
+
+        self.runs += 1
+        started = datetime.now()
+        try:
+            self.run_once()
+            logger.info("Sync run %s finished in %s", self.runs, datetime.now() - started)
+        except Exception as e:
+            self.failures += 1
+            logger.error("Sync run %s failed: %s", self.runs, repr(e))
+        finally:
+            self.lock.release()
+
+    def run_forever(self):
+        logger.info("Sync daemon started, schedule: %s", self.schedule)
+        if self.run_on_start and not self._stop.is_set():
+            self._run()
+
+        while not self._stop.is_set():
+            next_run = self.schedule.next_run(datetime.now())
+            logger.info("Next sync at %s", next_run.isoformat(timespec="seconds"))
+            if self._stop.wait(max(0.0, (next_run - datetime.now()).total_seconds())):
+                break
+            self._run()
+
+        logger.info("Sync daemon stopped after %s runs (%s failed)", self.runs, self.failures)
@@ -1,132 +1,443 @@
+import logging
+
 import gspread
 from gspread.cell import Cell
+from gspread.utils import a1_range_to_grid_range
 from oauth2client.service_account import ServiceAccountCredentials
 
-from app.utils import rate_limit, retry_request
+from app.cache import LRUCache
+from app.metrics import instrument
+from app.utils import get_rate_limiter, rate_limit, retry_request
+from app.worksheets import WorksheetBackend
+
+logger = logging.getLogger(__name__)
+
+LAST_ROW_KEY = "last_row"
+
+
+class SheetSnapshot:
+    """Копия значений листа в памяти с индексом значение -> позиции ячеек"""
+
+    def __init__(self, values: list[list[str]]):
+        self.values = values
+        self._index: dict[str, list[tuple[int, int]]] | None = None
+
+    @property
+    def index(self) -> dict[str, list[tuple[int, int]]]:
+        # Индекс строится лениво, чтобы подряд идущие вставки строк не перестраивали его каждый раз
+        if self._index is None:
+            index = {}
+            for row, row_values in enumerate(self.values, start=1):
+                for col, value in enumerate(row_values, start=1):
+                    if value != "":
+                        index.setdefault(value, []).append((row, col))
+            self._index = index
+        return self._index
+
+    @property
+    def last_row(self) -> int:
+        return len(self.values)
+
+    def findall(self, value: str, in_column: int | None = None) -> list[tuple[int, int]]:
+        """Возвращает позиции (row, col) в том же порядке, что и gspread: построчно слева направо"""
+        positions = self.index.get(str(value), [])
+        if in_column:
+            positions = [position for position in positions if position[1] == in_column]
+        return positions
+
+    def get_row(self, row: int) -> list[str]:
+        if row > len(self.values):
+            return []
+        return self.values[row - 1]
+
+    def get_cell(self, row: int, col: int) -> str:
+        row_values = self.get_row(row)
+        return row_values[col - 1] if col <= len(row_values) else ""
+
+    def get_column(self, col: int) -> list[str]:
+        column = [row_values[col - 1] if col <= len(row_values) else "" for row_values in self.values]
+        # Как и gspread, отбрасываем пустые значения в конце колонки
+        while column and column[-1] == "":
+            column.pop()
+        return column
+
+    def set_cell(self, row: int, col: int, value):
+        while len(self.values) < row:
+            self.values.append([])
+        row_values = self.values[row - 1]
+        if len(row_values) < col:
+            row_values.extend([""] * (col - len(row_values)))
+
+        value = "" if value is None else str(value)
+        previous = row_values[col - 1]
+        row_values[col - 1] = value
+
+        if self._index is not None and previous != value:
+            if previous != "":
+                self._index[previous].remove((row, col))
+                if not self._index[previous]:
+                    del self._index[previous]
+            if value != "":
+                positions = self._index.setdefault(value, [])
+                positions.append((row, col))
+                positions.sort()
+
+    def insert_row(self, values: list, position: int):
+        while len(self.values) < position - 1:
+            self.values.append([])
+        self.values.insert(position - 1, ["" if value is None else str(value) for value in values])
+        self._index = None
+
+    def insert_rows(self, rows: list[list], position: int):
+        for offset, values in enumerate(rows):
+            self.insert_row(values, position + offset)
 
 
 class GoogleSheetsClient:
-    def __init__(self, google_sheets_key: str, worksheet_name: str, token_path: str):
+    def __init__(
+        self,
+        google_sheets_key: str,
+        worksheet_name: str,
+        token_path: str,
+        max_requests: int = 60,
+        per_seconds: float = 60,
+        burst: int = 10,
+        cache_max_size: int = 1024,
+        cache_ttl: float | None = 300,
+        worksheet: WorksheetBackend | None = None,
+    ):
         self.google_sheets_key = google_sheets_key
         self.worksheet_name = worksheet_name
         self.token_path = token_path
-        self.client = self._get_google_sheets_client()
-        self.sheet = self.client.open_by_key(self.google_sheets_key).worksheet(self.worksheet_name)
 
-        # Кеш для значений
-        self._row_cache = {}
-        self._col_cache = {}
-        self._cell_cache = {}
-        self._find_cache = {}
+        if worksheet is not None:
+            # Локальный лист (в памяти или в файле) вместо Google API
+            self.credentials = None
+            self.client = None
+            self.rate_limiter = get_rate_limiter(
+                f"local:{worksheet_name}",
+                max_requests=max_requests,
+                per_seconds=per_seconds,
+                burst=burst,
+            )
+            self.sheet = worksheet
+        else:
+            self.credentials = self._get_credentials()
+            # Квота Google считается на учетную запись, поэтому лимитер общий для всех клиентов с ней
+            self.rate_limiter = get_rate_limiter(
+                self.credentials.service_account_email,
+                max_requests=max_requests,
+                per_seconds=per_seconds,
+                burst=burst,
+            )
+            # Открытие таблицы и листа - два запроса метаданных
+            self.rate_limiter.acquire(cost=2)
+            self.client = gspread.authorize(self.credentials)
+            self.sheet = self.client.open_by_key(self.google_sheets_key).worksheet(self.worksheet_name)
+
+        # Снимок всего листа, после загрузки поиск выполняется без обращений к API
+        self.snapshot: SheetSnapshot | None = None
 
-    def _get_google_sheets_client(self):
+        # Ограниченные кеши ответов API для работы без снимка
+        self._row_cache = LRUCache(max_size=cache_max_size, ttl=cache_ttl)
+        self._col_cache = LRUCache(max_size=cache_max_size, ttl=cache_ttl)
+        self._cell_cache = LRUCache(max_size=cache_max_size, ttl=cache_ttl)
+        self._find_cache = LRUCache(max_size=cache_max_size, ttl=cache_ttl)
+        self._last_row_cache = LRUCache(max_size=1, ttl=cache_ttl)
+
+    def _get_credentials(self) -> ServiceAccountCredentials:
         scope = [
             "https://spreadsheets.google.com/feeds",
             "https://www.googleapis.com/auth/spreadsheets",
             "https://www.googleapis.com/auth/drive.file",
             "https://www.googleapis.com/auth/drive",
         ]
-        credentials = ServiceAccountCredentials.from_json_keyfile_name(self.token_path, scope)
-        return gspread.authorize(credentials)
+        return ServiceAccountCredentials.from_json_keyfile_name(self.token_path, scope)
 
+    @instrument()
     @retry_request()
-    @rate_limit(max_requests=60, per_seconds=60)
+    @rate_limit()
+    def load_snapshot(self) -> SheetSnapshot:
+        """Загружает весь лист одним запросом"""
+        self.snapshot = SheetSnapshot(self.sheet.get_all_values())
+        logger.info("Loaded worksheet snapshot: %s rows", self.snapshot.last_row)
+        return self.snapshot
+
     def write_row(self, row, position: int | None = None):
-        if position:
-            self.sheet.insert_row(row, position)
-            # Инвалидируем кеш для затронутых строк
-            self._row_cache.clear()
-            self._cell_cache.clear()
-            # Очищаем кеш последней строки
-            if "last_row" in self._find_cache:
-                del self._find_cache["last_row"]
-        else:
-            self.sheet.insert_row(row)
-            self._row_cache.clear()
-            self._cell_cache.clear()
-            if "last_row" in self._find_cache:
-                del self._find_cache["last_row"]
+        position = position or 1
+        self._insert_row(row, position)
+        self._shift_cached_rows(position, [row])
+
+        if self.snapshot is not None:
+            self.snapshot.insert_row(row, position)
 
+    @instrument()
     @retry_request()
-    @rate_limit(max_requests=60, per_seconds=60)
-    def get_column_values(self) -> list[str]:
-        col_key = 3  # Первая колонка
-        if col_key not in self._col_cache:
-            self._col_cache[col_key] = self.sheet.col_values(col_key)
-        return self._col_cache[col_key]
+    @rate_limit()
+    def _insert_row(self, row, position: int):
+        self.sheet.insert_row(row, position)
+
+    def _shift_cached_rows(self, position: int, rows: list[list]):
+        """Сдвигает закешированные номера строк после вставки rows на позицию position"""
+        count = len(rows)
+        inserted_values = {str(value) for row in rows for value in row if value not in (None, "")}
+
+        def shift_row(row: int) -> int:
+            return row + count if row >= position else row
+
+        self._row_cache.remap(lambda row, values: (shift_row(row), values))
+        self._cell_cache.remap(lambda key, value: ((shift_row(key[0]), key[1]), value))
+
+        def shift_column(col: int, values: list[str]):
+            if len(values) < position - 1:
+                # Вставка ниже последнего значения колонки
+                return col, values
+            column = values[: position - 1]
+            column.extend("" if col > len(row) or row[col - 1] is None else str(row[col - 1]) for row in rows)
+            column.extend(values[position - 1 :])
+            while column and column[-1] == "":
+                column.pop()
+            return col, column
+
+        self._col_cache.remap(shift_column)
+
+        def shift_position(key, cell_position: tuple[int, int]):
+            value = key[0]
+            if value in inserted_values:
+                # Новая строка может оказаться первым или последним совпадением
+                return None
+            return key, (cell_position[0], shift_row(cell_position[1]))
+
+        self._find_cache.remap(shift_position)
+
+        # remap сохраняет время жизни записи, иначе просроченное значение ожило бы после вставки
+        self._last_row_cache.remap(lambda key, last_row: (key, max(last_row, position - 1) + count))
+
+    def get_column_values(self, col_key: int = 3) -> list[str]:
+        # По умолчанию первая заполненная колонка (ФИО)
+        if self.snapshot is not None:
+            return self.snapshot.get_column(col_key)
+
+        return self._get_column_values(col_key)
 
+    def _get_column_values(self, col_key: int) -> list[str]:
+        values = self._col_cache.get(col_key)
+        if values is None:
+            values = self._fetch_column_values(col_key)
+            self._col_cache.set(col_key, values)
+        return values
+
+    @instrument()
+    @retry_request()
+    @rate_limit()
+    def _fetch_column_values(self, col_key: int) -> list[str]:
+        return self.sheet.col_values(col_key)
+
+    def get_header_rows(self, count: int) -> list[list[str]]:
+        if self.snapshot is not None:
+            return [self.snapshot.get_row(row) for row in range(1, count + 1)]
+
+        return self._get_header_rows(count)
+
+    @instrument()
     @retry_request()
-    @rate_limit(max_requests=60, per_seconds=60)
+    @rate_limit()
+    def _get_header_rows(self, count: int) -> list[list[str]]:
+        """Читает первые count строк листа одним запросом"""
+        return self.sheet.get_values(f"1:{count}")
+
     def get_row_values(self, row: int) -> list[str]:
-        if row not in self._row_cache:
-            self._row_cache[row] = self.sheet.row_values(row)
-        return self._row_cache[row]
+        if self.snapshot is not None:
+            return self.snapshot.get_row(row)
+
+        return self._get_row_values(row)
+
+    def _get_row_values(self, row: int) -> list[str]:
+        values = self._row_cache.get(row)
+        if values is None:
+            values = self._fetch_row_values(row)
+            self._row_cache.set(row, values)
+        return values
 
+    @instrument()
     @retry_request()
-    @rate_limit(max_requests=60, per_seconds=60)
+    @rate_limit()
+    def _fetch_row_values(self, row: int) -> list[str]:
+        return self.sheet.row_values(row)
+
     def update_cells(self, updates: list[tuple[int, int, str]]):
-        cells = []
+        self._update_cells(updates)
+
+        updated_positions = set()
+        updated_values = set()
         for row, col, value in updates:
-            cell = Cell(row=row, col=col, value=value)
-            cells.append(cell)
+            self._cell_cache.set((row, col), value)
+            # Сбрасываем только затронутые строки и колонки
+            self._row_cache.pop(row)
+            self._col_cache.pop(col)
+            updated_positions.add((col, row))
+            updated_values.add(str(value))
 
-            # Обновляем кеш
-            cache_key = (row, col)
-            self._cell_cache[cache_key] = value
+        # Результаты поиска устарели, если ячейка результата изменилась или значение появилось в другом месте
+        self._find_cache.remap(
+            lambda key, position: (
+                None if position in updated_positions or key[0] in updated_values else (key, position)
+            )
+        )
+        self._last_row_cache.clear()
 
-            # Инвалидируем строки и колонки, которые были изменены
-            if row in self._row_cache:
-                del self._row_cache[row]
-            if col in self._col_cache:
-                del self._col_cache[col]
+        if self.snapshot is not None:
+            for row, col, value in updates:
+                self.snapshot.set_cell(row, col, value)
 
+    @instrument()
+    @retry_request()
+    @rate_limit()
+    def _update_cells(self, updates: list[tuple[int, int, str]]):
+        cells = [Cell(row=row, col=col, value=value) for row, col, value in updates]
         # Обновляем все ячейки одним запросом
         self.sheet.update_cells(cells)
 
+    def batch_update(self, data: list[dict]):
+        """Записывает несколько диапазонов одним запросом values:batchUpdate"""
+        self._batch_update(data)
+
+        rows, cols = set(), set()
+        for value_range in data:
+            grid_range = a1_range_to_grid_range(value_range["range"])
+            rows.update(range(grid_range["startRowIndex"] + 1, grid_range["endRowIndex"] + 1))
+            cols.update(range(grid_range["startColumnIndex"] + 1, grid_range["endColumnIndex"] + 1))
+
+        self._row_cache.remap(lambda row, values: None if row in rows else (row, values))
+        self._col_cache.remap(lambda col, values: None if col in cols else (col, values))
+        self._cell_cache.remap(lambda key, value: None if key[0] in rows and key[1] in cols else (key, value))
+        # Записанные значения могли стать новыми совпадениями поиска где угодно в диапазоне
+        self._find_cache.clear()
+        self._last_row_cache.clear()
+
+    @instrument()
+    @retry_request()
+    @rate_limit()
+    def _batch_update(self, data: list[dict]):
+        self.sheet.batch_update(data)
+
+    def insert_blank_rows(self, inserts: list[tuple[int, int]]):
+        """Вставляет пустые строки одним запросом spreadsheets.batchUpdate.
+
+        inserts - пары (строка, количество) в координатах листа до вставок, строки вставляются перед строкой.
+        Вставки выполняются снизу вверх, поэтому ни одна не сдвигает место остальных.
+        """
+        inserts = sorted(inserts, reverse=True)
+        if not inserts:
+            return
+
+        self._insert_blank_rows(inserts)
+
+        for position, count in inserts:
+            rows = [[] for _ in range(count)]
+            self._shift_cached_rows(position, rows)
+            if self.snapshot is not None:
+                self.snapshot.insert_rows(rows, position)
+
+    @instrument()
     @retry_request()
-    @rate_limit(max_requests=60, per_seconds=60)
+    @rate_limit()
+    def _insert_blank_rows(self, inserts: list[tuple[int, int]]):
+        requests = [
+            {
+                "insertDimension": {
+                    "range": {
+                        "sheetId": self.sheet.id,
+                        "dimension": "ROWS",
+                        "startIndex": position - 1,
+                        "endIndex": position - 1 + count,
+                    },
+                    # Новые строки берут оформление строки выше, как при вставке из интерфейса
+                    "inheritFromBefore": position > 1,
+                }
+            }
+            for position, count in inserts
+        ]
+        self.sheet.spreadsheet.batch_update({"requests": requests})
+
     def get_last_row(self) -> int:
         """Получает номер последней заполненной строки"""
-        cache_key = "last_row"
-        if cache_key not in self._find_cache:
+        last_row = self._last_row_cache.get(LAST_ROW_KEY)
+        if last_row is None:
             # Получаем все значения первой колонки
             col_values = self.get_column_values()
             # Находим последнюю непустую строку
-            last_row = len([val for val in col_values])
-            self._find_cache[cache_key] = last_row
-        return self._find_cache[cache_key]
+            last_row = len(col_values)
+            self._last_row_cache.set(LAST_ROW_KEY, last_row)
+        return last_row
 
-    @retry_request()
-    @rate_limit(max_requests=60, per_seconds=60)
     def find(self, value: str, in_column: int | None = None) -> tuple[int, int]:
-        cache_key = (value, in_column)
-        if cache_key not in self._find_cache:
-            if in_column:
-                cell = self.sheet.find(str(value), in_column=in_column)
-            else:
-                cell = self.sheet.find(str(value))
-
-            if cell:
-                self._find_cache[cache_key] = (cell.col, cell.row)
-            else:
+        if self.snapshot is not None:
+            positions = self.snapshot.findall(value, in_column=in_column)
+            if not positions:
                 raise ValueError(f"Value '{value}' not found in the sheet")
+            row, col = positions[0]
+            return col, row
 
-        return self._find_cache[cache_key]
+        return self._find(value, in_column=in_column)
 
+    def _find(self, value: str, in_column: int | None = None) -> tuple[int, int]:
+        cache_key = (str(value), in_column, "first")
+        position = self._find_cache.get(cache_key)
+        if position is None:
+            position = self._fetch_find(value, in_column=in_column)
+            self._find_cache.set(cache_key, position)
+        return position
+
+    @instrument()
     @retry_request()
-    @rate_limit(max_requests=60, per_seconds=60)
+    @rate_limit()
+    def _fetch_find(self, value: str, in_column: int | None = None) -> tuple[int, int]:
+        if in_column:
+            cell = self.sheet.find(str(value), in_column=in_column)
+        else:
+            cell = self.sheet.find(str(value))
+
+        if not cell:
+            raise ValueError(f"Value '{value}' not found in the sheet")
+        return cell.col, cell.row
+
     def find_last(self, value: str):
-        cache_key = f"last_{value}"
-        if cache_key not in self._find_cache:
-            cells = self.sheet.findall(str(value))
-
-            if cells:
-                last_cell = cells[-1]
-                self._find_cache[cache_key] = (last_cell.col, last_cell.row)
-            else:
+        if self.snapshot is not None:
+            positions = self.snapshot.findall(value)
+            if not positions:
                 raise ValueError(f"Value '{value}' not found in the sheet")
+            row, col = positions[-1]
+            return col, row
+
+        return self._find_last(value)
+
+    def _find_last(self, value: str):
+        cache_key = (str(value), None, "last")
+        position = self._find_cache.get(cache_key)
+        if position is None:
+            position = self._fetch_find_last(value)
+            self._find_cache.set(cache_key, position)
+        return position
+
+    @instrument()
+    @retry_request()
+    @rate_limit()
+    def _fetch_find_last(self, value: str):
+        cells = self.sheet.findall(str(value))
+        if not cells:
+            raise ValueError(f"Value '{value}' not found in the sheet")
+        last_cell = cells[-1]
+        return last_cell.col, last_cell.row
 
-        return self._find_cache[cache_key]
+    @property
+    def cache_metrics(self) -> dict[str, dict[str, int]]:
+        return {
+            "rows": self._row_cache.metrics,
+            "columns": self._col_cache.metrics,
+            "cells": self._cell_cache.metrics,
+            "find": self._find_cache.metrics,
+        }
 
     def clear_cache(self):
         """Очищает все кеши"""
@@ -134,3 +445,5 @@ class GoogleSheetsClient:
         self._col_cache.clear()
         self._cell_cache.clear()
         self._find_cache.clear()
+        self._last_row_cache.clear()
+        self.snapshot = None
@@ -0,0 +1,38 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, TextIO
+
+
+@contextmanager
+def atomic_write(path: str, newline: str | None = None) -> Iterator[TextIO]:
+    """Пишет во временный файл и заменяет им path только после успешной записи.
+
+    Прерванный запуск не оставляет наполовину записанный файл.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # Уникальное имя в том же каталоге: одновременные записи не мешают друг другу, а os.replace атомарен
+    file = tempfile.NamedTemporaryFile(
+        "w",
+        encoding="utf-8",
+        newline=newline,
+        dir=directory or ".",
+        prefix=f".{os.path.basename(path)}.",
+        suffix=".tmp",
+        delete=False,
+    )
+    try:
+        with file:
+            yield file
+        # NamedTemporaryFile создается с правами 0600, а файлы читают и другие процессы (node_exporter)
+        os.chmod(file.name, 0o644)
+        os.replace(file.name, path)
+    except BaseException:
+        try:
+            os.remove(file.name)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,226 @@
+import inspect
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from functools import wraps
+from typing import Iterable, Iterator, TypeVar
+
+from app.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+METRIC_PREFIX = "clinics_sync"
+
+
+@dataclass(slots=True)
+class SpanStats:
+    count: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+
+@dataclass(slots=True)
+class CallStats:
+    calls: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    bytes: int = 0
+    retries: int = 0
+    wait_seconds: float = 0.0
+
+
+class MetricsRegistry:
+    """Счетчики запуска: длительность фаз (span) и вызовы API по компоненту и методу"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans: dict[str, SpanStats] = {}
+        self.calls: dict[tuple[str, str], CallStats] = {}
+        self.started_at = time.time()
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self.calls.clear()
+            self.started_at = time.time()
+
+    def _call_stats(self, component: str, method: str) -> CallStats:
+        key = (component, method)
+        stats = self.calls.get(key)
+        if stats is None:
+            stats = self.calls[key] = CallStats()
+        return stats
+
+    def add_span(self, name: str, seconds: float):
+        with self._lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.add(seconds)
+
+    @contextmanager
+    def span(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, time.perf_counter() - started)
+
+    def timed_iter(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        """Учитывает в span name только время получения элементов ленивого итератора"""
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_span(name, time.perf_counter() - started)
+                return
+            self.add_span(name, time.perf_counter() - started)
+            yield item
+
+    def add_call(self, component: str, method: str, seconds: float, error: bool = False):
+        with self._lock:
+            stats = self._call_stats(component, method)
+            stats.calls += 1
+            stats.seconds += seconds
+            if error:
+                stats.errors += 1
+
+    def add_bytes(self, component: str, method: str, size: int):
+        with self._lock:
+            self._call_stats(component, method).bytes += size
+
+    def add_retry(self, component: str, method: str, wait_seconds: float):
+        with self._lock:
+            stats = self._call_stats(component, method)
+            stats.retries += 1
+            stats.wait_seconds += wait_seconds
+
+    def add_wait(self, component: str, method: str, wait_seconds: float):
+        with self._lock:
+            self._call_stats(component, method).wait_seconds += wait_seconds
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "started_at": self.started_at,
+                "duration_seconds": round(time.time() - self.started_at, 3),
+                "spans": {name: asdict(stats) for name, stats in sorted(self.spans.items())},
+                "calls": [
+                    {"component": component, "method": method, **asdict(stats)}
+                    for (component, method), stats in sorted(self.calls.items())
+                ],
+            }
+
+    def to_prometheus(self) -> str:
+        summary = self.summary()
+        lines = []
+
+        def metric(name: str, metric_type: str, help_text: str, samples: list[tuple[dict, float]]):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {metric_type}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{escape_label(label)}"' for key, label in labels.items())
+                lines.append(f"{METRIC_PREFIX}_{name}{{{label_text}}} {value}")
+
+        spans = summary["spans"]
+        metric(
+            "span_seconds_total",
+            "counter",
+            "Time spent in a phase",
+            [({"span": n}, s["seconds"]) for n, s in spans.items()],
+        )
+        metric(
+            "span_count_total",
+            "counter",
+            "Number of phase executions",
+            [({"span": n}, s["count"]) for n, s in spans.items()],
+        )
+
+        calls = summary["calls"]
+        for field, metric_type, help_text in (
+            ("calls", "counter", "API method calls"),
+            ("errors", "counter", "API method calls that raised"),
+            ("seconds", "counter", "Time spent in API methods"),
+            ("bytes", "counter", "Response bytes received"),
+            ("retries", "counter", "Retried API requests"),
+            ("wait_seconds", "counter", "Time spent waiting for the rate limiter and retry backoff"),
+        ):
+            samples = [({"component": c["component"], "method": c["method"]}, c[field]) for c in calls]
+            metric(f"api_{field}_total", metric_type, help_text, samples)
+
+        lines.append(f"# HELP {METRIC_PREFIX}_last_run_duration_seconds Duration of the last run")
+        lines.append(f"# TYPE {METRIC_PREFIX}_last_run_duration_seconds gauge")
+        lines.append(f"{METRIC_PREFIX}_last_run_duration_seconds {summary['duration_seconds']}")
+        lines.append(f"# HELP {METRIC_PREFIX}_last_run_timestamp_seconds Start time of the last run")
+        lines.append(f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge")
+        lines.append(f"{METRIC_PREFIX}_last_run_timestamp_seconds {summary['started_at']}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, json_path: str | None = None, prometheus_path: str | None = None):
+        """Пишет сводку в JSON и в textfile для node_exporter, файлы заменяются атомарно"""
+        if json_path:
+            with atomic_write(json_path) as file:
+                json.dump(self.summary(), file, ensure_ascii=False, indent=2)
+        if prometheus_path:
+            with atomic_write(prometheus_path) as file:
+                file.write(self.to_prometheus())
+        logger.info("Run metrics: %s", json.dumps(self.summary()["spans"]))
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+metrics = MetricsRegistry()
+
+
+def instrument():
+    """Считает вызовы, ошибки и длительность метода под меткой (имя класса, имя метода).
+
+    Для генераторов учитывается время до полного получения всех элементов.
+    """
+
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+
+            @wraps(func)
+            def generator_wrapper(self, *args, **kwargs):
+                started = time.perf_counter()
+                error = False
+                try:
+                    yield from func(self, *args, **kwargs)
+                except Exception:
+                    error = True
+                    raise
+                finally:
+                    metrics.add_call(type(self).__name__, func.__name__, time.perf_counter() - started, error=error)
+
+            return generator_wrapper
+
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            started = time.perf_counter()
+            error = False
+            try:
+                return func(self, *args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                metrics.add_call(type(self).__name__, func.__name__, time.perf_counter() - started, error=error)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,47 @@
+import bisect
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PatientCodeIndex:
+    """Отсортированный индекс кодов пациентов листа для поиска строки и места вставки за O(log n)"""
+
+    def __init__(self, column_values: list[str]):
+        self.rows: dict[int, int] = {}
+        for row, value in enumerate(column_values, start=1):
+            try:
+                code = int(str(value).strip())
+            except ValueError:
+                continue
+            self.rows.setdefault(code, row)
+
+        self.codes = sorted(self.rows)
+        # Строки листа, перед которыми вставляется код, идущий сразу перед или сразу после codes[i]
+        self.before_rows = [self.rows[code] for code in self.codes]
+        self.after_rows = [row + 1 for row in self.before_rows]
+        self.append_row = len(column_values) + 1
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def find_row(self, code: int) -> int | None:
+        return self.rows.get(code)
+
+    def get_insert_row(self, code: int) -> int:
+        """Возвращает строку листа, перед которой нужно вставить новый код: сразу за ближайшим меньшим кодом"""
+        index = bisect.bisect_left(self.codes, code)
+        if index:
+            return self.after_rows[index - 1]
+        if self.codes:
+            # Меньших кодов нет, ставим перед самым маленьким
+            return self.before_rows[0]
+        return self.append_row
+
+    def add(self, code: int, row: int, insert_row: int):
+        """Добавляет запланированный код, чтобы следующие коды вставлялись в ту же позицию после него"""
+        index = bisect.bisect_left(self.codes, code)
+        self.codes.insert(index, code)
+        self.before_rows.insert(index, insert_row)
+        self.after_rows.insert(index, insert_row)
+        self.rows[code] = row
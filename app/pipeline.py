@@ -0,0 +1,95 @@
+import logging
+import queue
+import threading
+from typing import Callable, Iterable, TypeVar
+
+from app.sheet_writer import SheetWritePlanner
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_DONE = object()
+QUEUE_POLL_SECONDS = 0.1
+
+
+class BackgroundFlusher:
+    """Фоновый поток, отправляющий накопленные изменения листа, пока идет планирование следующих.
+
+    Запросы проходят через лимитер клиента, поэтому общая квота соблюдается вместе с остальными вызовами.
+    """
+
+    def __init__(self, write_planner: SheetWritePlanner, min_cells: int = 5000, interval: float = 5.0):
+        self.write_planner = write_planner
+        self.min_cells = min_cells
+        self.interval = interval
+        self.requests = 0
+        self.error: Exception | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sheet-flusher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.write_planner.pending_cells < self.min_cells:
+                continue
+            try:
+                self.requests += self.write_planner.flush_updates()
+            except Exception as e:
+                logger.error("Background flush failed: %s", repr(e))
+                self.error = e
+                return
+
+    def stop(self):
+        """Останавливает поток и пробрасывает его ошибку, оставшиеся изменения отправит flush планировщика"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        logger.info("Background flusher sent %s requests", self.requests)
+        if self.error is not None:
+            raise self.error
+
+
+def run_pipeline(items: Iterable[T], handle: Callable[[T], None], queue_size: int = 1000, name: str = "pipeline"):
+    """Передает элементы из текущего потока обработчику в отдельном потоке через ограниченную очередь.
+
+    Производитель ждет, если обработчик отстает, и останавливается, если обработчик упал.
+    """
+    items_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    errors: list[Exception] = []
+
+    def consume():
+        try:
+            while True:
+                item = items_queue.get()
+                if item is _DONE:
+                    return
+                handle(item)
+        except Exception as e:
+            errors.append(e)
+
+    consumer = threading.Thread(target=consume, name=f"{name}-consumer", daemon=True)
+    consumer.start()
+
+    def put(item) -> bool:
+        while consumer.is_alive():
+            try:
+                items_queue.put(item, timeout=QUEUE_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for item in items:
+            if not put(item):
+                break
+    finally:
+        put(_DONE)
+        consumer.join()
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,124 @@
+import cProfile
+import logging
+import os
+import pstats
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE_DIR = "data/profiles"
+
+
+@dataclass(slots=True)
+class PhaseProfile:
+    name: str
+    stats: pstats.Stats
+    peak_memory: int
+
+
+class Profiler:
+    """Профилирование фаз запуска через cProfile и tracemalloc.
+
+    Пока профилирование не включено, phase возвращает пустой контекст и почти ничего не стоит.
+    cProfile видит только поток, в котором выполняется фаза, работа пулов потоков в нем
+    отражается как ожидание результатов. В режиме демона каждый запуск начинается с start_run
+    и заканчивается report, поэтому файлы не перезаписываются, а статистика не копится.
+    """
+
+    def __init__(self):
+        self.output_dir: str | None = None
+        self.top = 20
+        self.phases: list[PhaseProfile] = []
+        self._run_id = ""
+        self._active = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.output_dir is not None
+
+    def enable(self, output_dir: str = DEFAULT_PROFILE_DIR, top: int = 20):
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.top = top
+        self.start_run()
+
+    def start_run(self):
+        """Начинает новый запуск: файлы фаз получают новый префикс, собранная статистика сбрасывается"""
+        self._run_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.phases.clear()
+
+    def phase(self, name: str):
+        # Вложенные фазы входят в профиль внешней, второй cProfile одновременно включить нельзя
+        if not self.enabled or self._active:
+            return nullcontext()
+        return self._profile_phase(name)
+
+    @contextmanager
+    def _profile_phase(self, name: str):
+        self._active = True
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(10)
+        tracemalloc.reset_peak()
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            snapshot = tracemalloc.take_snapshot()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+            self._active = False
+
+            self._save_phase(name, profile, snapshot, peak_memory)
+
+    def _save_phase(self, name: str, profile: cProfile.Profile, snapshot: tracemalloc.Snapshot, peak_memory: int):
+        prefix = os.path.join(self.output_dir, f"{self._run_id}-{name}")
+        profile.dump_stats(f"{prefix}.pstats")
+
+        snapshot = snapshot.filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, cProfile.__file__),
+            )
+        )
+        with open(f"{prefix}-allocations.txt", "w", encoding="utf-8") as file:
+            file.write(f"Peak traced memory: {peak_memory / 1024 / 1024:.1f} MiB\n\n")
+            for statistic in snapshot.statistics("lineno")[: self.top]:
+                file.write(f"{statistic}\n")
+
+        self.phases.append(PhaseProfile(name=name, stats=pstats.Stats(profile), peak_memory=peak_memory))
+        logger.info("Saved profile of phase %s to %s.pstats", name, prefix)
+
+    def format_hotspots(self) -> str:
+        """Таблица самых затратных функций по собственному времени во всех фазах"""
+        rows = []
+        for phase in self.phases:
+            for (filename, line, function), (_, calls, own_time, cumulative_time, _) in phase.stats.stats.items():
+                location = f"{os.path.basename(filename)}:{line}({function})" if line else function
+                rows.append((own_time, cumulative_time, calls, phase.name, location))
+        rows.sort(reverse=True)
+
+        lines = [f"{'#':>3} {'phase':<12} {'own, s':>9} {'cum, s':>9} {'calls':>10}  function"]
+        for rank, (own_time, cumulative_time, calls, phase_name, location) in enumerate(rows[: self.top], start=1):
+            lines.append(
+                f"{rank:>3} {phase_name:<12} {own_time:>9.3f} {cumulative_time:>9.3f} {calls:>10}  {location}"
+            )
+        for phase in self.phases:
+            lines.append(f"Peak memory of {phase.name}: {phase.peak_memory / 1024 / 1024:.1f} MiB")
+        return "\n".join(lines)
+
+    def report(self):
+        """Печатает горячие функции запуска и освобождает их статистику"""
+        if self.phases:
+            print(self.format_hotspots())
+            self.phases.clear()
+
+
+profiler = Profiler()
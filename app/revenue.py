@@ -0,0 +1,153 @@
+"""Агрегация выручки и количества оплативших пациентов по всем счетам.
+
+Если установлен NumPy, группировка выполняется векторно, иначе - одним проходом по колонкам на чистом Python.
+Результаты одинаковые: суммы считаются в целых единицах, дробная часть каждого счета отбрасывается.
+"""
+
+import logging
+from array import array
+from dataclasses import dataclass, field
+from datetime import date
+
+from app.clinics_card.entities import Patient
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+logger = logging.getLogger(__name__)
+
+UNIX_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+@dataclass(slots=True)
+class RevenueSummary:
+    # Ключи дней - ordinal даты, ключи месяцев - (год, месяц)
+    paying_patients_by_day: dict[int, int] = field(default_factory=dict)
+    revenue_by_day: dict[int, int] = field(default_factory=dict)
+    revenue_by_day_and_patient: dict[tuple[int, str], int] = field(default_factory=dict)
+    revenue_by_month: dict[tuple[int, int], int] = field(default_factory=dict)
+    revenue_by_doctor: dict[str, int] = field(default_factory=dict)
+    revenue_by_curator: dict[str, int] = field(default_factory=dict)
+
+
+class RevenueEngine:
+    """Копит счета пациентов в колонках и считает все группировки за один раз.
+
+    Выручка по врачу относится к врачу первого визита пациента, по куратору - к куратору пациента.
+    """
+
+    def __init__(self, date_from: date | None = None, use_numpy: bool = True):
+        self.date_from = date_from.toordinal() if date_from else 0
+        self.use_numpy = use_numpy and np is not None
+
+        self.patient_ids: list[str] = []
+        self.patient_doctors: list[str] = []
+        self.patient_curators: list[str] = []
+
+        self.patients = array("l")
+        self.dates = array("l")
+        self.amounts = array("q")
+
+    def add_patient(self, patient: Patient):
+        patient_index = len(self.patient_ids)
+        self.patient_ids.append(str(patient.id))
+        self.patient_doctors.append(patient.aggregates.first_doctor or "")
+        self.patient_curators.append(patient.curator or "")
+
+        for date_ordinal, amount_cents in zip(patient.invoices.dates, patient.invoices.amounts):
+            if date_ordinal < self.date_from:
+                continue
+            self.patients.append(patient_index)
+            self.dates.append(date_ordinal)
+            self.amounts.append(int(amount_cents / 100))
+
+    def compute(self) -> RevenueSummary:
+        if not self.dates:
+            return RevenueSummary()
+        if self.use_numpy:
+            return self._compute_numpy()
+        return self._compute_python()
+
+    def _compute_python(self) -> RevenueSummary:
+        summary = RevenueSummary()
+
+        for patient_index, date_ordinal, amount in zip(self.patients, self.dates, self.amounts):
+            patient_key = (date_ordinal, self.patient_ids[patient_index])
+            if patient_key not in summary.revenue_by_day_and_patient:
+                summary.revenue_by_day_and_patient[patient_key] = 0
+                summary.paying_patients_by_day[date_ordinal] = summary.paying_patients_by_day.get(date_ordinal, 0) + 1
+            summary.revenue_by_day_and_patient[patient_key] += amount
+
+            summary.revenue_by_day[date_ordinal] = summary.revenue_by_day.get(date_ordinal, 0) + amount
+
+            doctor = self.patient_doctors[patient_index]
+            summary.revenue_by_doctor[doctor] = summary.revenue_by_doctor.get(doctor, 0) + amount
+
+            curator = self.patient_curators[patient_index]
+            summary.revenue_by_curator[curator] = summary.revenue_by_curator.get(curator, 0) + amount
+
+        for date_ordinal, amount in summary.revenue_by_day.items():
+            day = date.fromordinal(date_ordinal)
+            month = (day.year, day.month)
+            summary.revenue_by_month[month] = summary.revenue_by_month.get(month, 0) + amount
+
+        return summary
+
+    def _compute_numpy(self) -> RevenueSummary:
+        patients = np.frombuffer(self.patients, dtype=self.patients.typecode).astype(np.int64)
+        days = np.frombuffer(self.dates, dtype=self.dates.typecode).astype(np.int64)
+        amounts = np.frombuffer(self.amounts, dtype=self.amounts.typecode).astype(np.int64)
+
+        # Группировка по паре (день, пациент) через один составной ключ
+        patients_count = len(self.patient_ids)
+        pair_keys, pair_inverse = np.unique(days * patients_count + patients, return_inverse=True)
+        pair_sums = np.bincount(pair_inverse, weights=amounts).astype(np.int64)
+        pair_days = pair_keys // patients_count
+        pair_patients = pair_keys % patients_count
+
+        paying_days, paying_counts = np.unique(pair_days, return_counts=True)
+        day_keys, day_inverse = np.unique(days, return_inverse=True)
+        day_sums = np.bincount(day_inverse, weights=amounts).astype(np.int64)
+
+        months = (day_keys - UNIX_EPOCH_ORDINAL).astype("datetime64[D]").astype("datetime64[M]")
+        month_keys, month_inverse = np.unique(months, return_inverse=True)
+        month_sums = np.bincount(month_inverse, weights=day_sums).astype(np.int64)
+
+        summary = RevenueSummary(
+            paying_patients_by_day=dict(zip(paying_days.tolist(), paying_counts.tolist())),
+            revenue_by_day=dict(zip(day_keys.tolist(), day_sums.tolist())),
+            revenue_by_day_and_patient={
+                (day, self.patient_ids[patient]): amount
+                for day, patient, amount in zip(pair_days.tolist(), pair_patients.tolist(), pair_sums.tolist())
+            },
+            revenue_by_month={
+                (month.year, month.month): amount
+                for month, amount in zip(month_keys.astype(date).tolist(), month_sums.tolist())
+            },
+        )
+
+        for names, rollup in (
+            (self.patient_doctors, summary.revenue_by_doctor),
+            (self.patient_curators, summary.revenue_by_curator),
+        ):
+            name_keys, name_codes = np.unique(np.array(names, dtype=object), return_inverse=True)
+            invoice_names = name_codes[patients]
+            name_sums = np.bincount(invoice_names, weights=amounts, minlength=len(name_keys)).astype(np.int64)
+            name_counts = np.bincount(invoice_names, minlength=len(name_keys))
+            rollup.update(
+                (name, amount)
+                for name, amount, count in zip(name_keys.tolist(), name_sums.tolist(), name_counts.tolist())
+                if count
+            )
+
+        return summary
+
+    def log_rollups(self, summary: RevenueSummary):
+        for (year, month), amount in sorted(summary.revenue_by_month.items()):
+            logger.info("Revenue %02d.%s: %s", month, year, amount)
+        for doctor, amount in sorted(summary.revenue_by_doctor.items(), key=lambda item: -item[1]):
+            logger.info("Revenue by doctor %s: %s", doctor or "-", amount)
+        for curator, amount in sorted(summary.revenue_by_curator.items(), key=lambda item: -item[1]):
+            logger.info("Revenue by curator %s: %s", curator or "-", amount)
@@ -0,0 +1,257 @@
+import bisect
+import logging
+import re
+import threading
+from datetime import date, datetime
+
+from gspread.utils import rowcol_to_a1
+
+from app.excel import GoogleSheetsClient
+
+logger = logging.getLogger(__name__)
+
+NUMBER_PATTERN = re.compile(r"^-?\d+([.,]\d+)?$")
+CURRENCY_SUFFIX_PATTERN = re.compile(r"\s*(₴|грн\.?|\$|€)$")
+SPACES_PATTERN = re.compile(r"[\s\u00a0\u202f]")
+
+
+def normalize_cell_value(value) -> str | float | date:
+    """Приводит значение ячейки к виду, в котором его можно сравнить с отформатированным значением листа"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return str(value).upper()
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+
+    text = str(value).strip()
+
+    number = SPACES_PATTERN.sub("", CURRENCY_SUFFIX_PATTERN.sub("", text))
+    if NUMBER_PATTERN.match(number):
+        return float(number.replace(",", "."))
+
+    for date_format in ("%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(text, date_format).date()
+        except ValueError:
+            pass
+
+    return text
+
+
+class SheetWritePlanner:
+    """Собирает все изменения ячеек за запуск и отправляет их минимальным числом batch_update запросов"""
+
+    def __init__(self, google_sheet_client: GoogleSheetsClient, max_cells_per_request: int = 40000):
+        self.google_sheet_client = google_sheet_client
+        self.max_cells_per_request = max_cells_per_request
+        self._updates: dict[tuple[int, int], object] = {}
+        self._new_rows: list[list] = []
+        # Для каждой новой строки: строка листа, перед которой ее нужно вставить, и порядок внутри группы
+        self._new_row_targets: list[tuple[int | None, object]] = []
+        self._next_row: int | None = None
+        self.changed_cells = 0
+        self.unchanged_cells = 0
+        # Планирование и фоновая отправка могут идти из разных потоков
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._updates)
+
+    @property
+    def _new_rows_start(self) -> int | None:
+        return self._next_row - len(self._new_rows) if self._next_row is not None else None
+
+    def add(self, updates: list[tuple[int, int, object]]):
+        """Планирует запись ячеек (row, col, value), повторная запись той же ячейки заменяет предыдущую.
+
+        Ячейки, значение которых в прочитанном снимке листа уже совпадает с нужным, не записываются.
+        """
+        with self._lock:
+            snapshot = self.google_sheet_client.snapshot
+            new_rows_start = self._new_rows_start
+            for row, col, value in updates:
+                if new_rows_start is not None and row >= new_rows_start:
+                    # Ячейки новых строк сравнивать не с чем, они уходят вместе со строкой
+                    self.changed_cells += 1
+                    self._updates[(row, col)] = value
+                    continue
+
+                current_value = snapshot.get_cell(row, col) if snapshot is not None else None
+                if snapshot is not None and normalize_cell_value(current_value) == normalize_cell_value(value):
+                    self.unchanged_cells += 1
+                    continue
+
+                self.changed_cells += 1
+                self._updates[(row, col)] = value
+                # Снимок обновляется сразу, чтобы поиск видел запланированные значения
+                if snapshot is not None:
+                    snapshot.set_cell(row, col, value)
+
+    def insert_row(self, values: list, before_row: int | None = None, order: object = 0) -> int:
+        """Планирует вставку новой строки перед строкой before_row текущего листа.
+
+        До отправки строка живет под временным номером после последней заполненной строки,
+        этот номер возвращается и используется для записи ее ячеек через add.
+        Строки с одним before_row встают подряд в порядке order, все вставки уходят одним запросом.
+        """
+        with self._lock:
+            if self._next_row is None:
+                self._next_row = self.google_sheet_client.get_last_row() + 1
+
+            row = self._next_row
+            self._next_row += 1
+            self._new_rows.append(list(values))
+            self._new_row_targets.append((before_row, order))
+            return row
+
+    @staticmethod
+    def _build_ranges(updates: dict[tuple[int, int], object]) -> list[dict]:
+        """Объединяет соседние ячейки одной строки в непрерывные диапазоны"""
+        ranges = []
+        for row, col in sorted(updates):
+            value = updates[(row, col)]
+            if ranges:
+                last = ranges[-1]
+                if last["row"] == row and last["col"] + len(last["values"]) == col:
+                    last["values"].append(value)
+                    continue
+            ranges.append({"row": row, "col": col, "values": [value]})
+        return ranges
+
+    def _insert_new_rows(self) -> int:
+        """Вставляет пустые строки для новых одним структурным запросом и планирует запись их значений.
+
+        Значения новых строк уходят вместе с остальными ячейками в values:batchUpdate, а номера строк
+        остальных ячеек переводятся в координаты листа после вставок. Возвращает число выполненных запросов.
+        """
+        start_row = self._new_rows_start
+
+        # Ячейки новых строк (например, суммы оплат) отправляем вместе со строками
+        for row, col in [cell for cell in self._updates if cell[0] >= start_row]:
+            row_values = self._new_rows[row - start_row]
+            if len(row_values) < col:
+                row_values.extend([""] * (col - len(row_values)))
+            row_values[col - 1] = self._updates.pop((row, col))
+
+        # Строки, которые встают после всех существующих, вставляются перед первой свободной строкой
+        groups: dict[int, list[tuple[object, int]]] = {}
+        for index, (before_row, order) in enumerate(self._new_row_targets):
+            if before_row is None or before_row >= start_row:
+                before_row = start_row
+            groups.setdefault(before_row, []).append((order, index))
+
+        new_row_updates: dict[tuple[int, int], object] = {}
+        inserted_before: list[int] = []
+        inserted_counts: list[int] = []
+        inserted = 0
+        for before_row in sorted(groups):
+            indexes = [index for _, index in sorted(groups[before_row], key=lambda item: item[0])]
+            for offset, index in enumerate(indexes):
+                for col, value in enumerate(self._new_rows[index], start=1):
+                    new_row_updates[(before_row + inserted + offset, col)] = value
+
+            inserted += len(indexes)
+            inserted_before.append(before_row)
+            inserted_counts.append(inserted)
+
+        self.google_sheet_client.insert_blank_rows([(before_row, len(rows)) for before_row, rows in groups.items()])
+        logger.info("Inserted %s new rows at %s places", inserted, len(groups))
+
+        # Переводим номера строк остальных ячеек в координаты листа после вставок
+        updates = {}
+        for (row, col), value in self._updates.items():
+            group = bisect.bisect_right(inserted_before, row)
+            updates[(row + (inserted_counts[group - 1] if group else 0), col)] = value
+        updates.update(new_row_updates)
+        self._updates = updates
+
+        snapshot = self.google_sheet_client.snapshot
+        if snapshot is not None:
+            for (row, col), value in new_row_updates.items():
+                snapshot.set_cell(row, col, value)
+
+        return 1
+
+    def _send_ranges(self, ranges: list[dict]) -> int:
+        """Отправляет диапазоны пачками не больше max_cells_per_request ячеек и возвращает число запросов"""
+        requests_count = 0
+        batch: list[dict] = []
+        batch_cells = 0
+
+        for cell_range in ranges:
+            values = cell_range["values"]
+            if batch and batch_cells + len(values) > self.max_cells_per_request:
+                self.google_sheet_client.batch_update(batch)
+                requests_count += 1
+                batch, batch_cells = [], 0
+
+            start = rowcol_to_a1(cell_range["row"], cell_range["col"])
+            end = rowcol_to_a1(cell_range["row"], cell_range["col"] + len(values) - 1)
+            batch.append({"range": f"{start}:{end}", "values": [values]})
+            batch_cells += len(values)
+
+        if batch:
+            self.google_sheet_client.batch_update(batch)
+            requests_count += 1
+
+        return requests_count
+
+    @property
+    def pending_cells(self) -> int:
+        """Число запланированных ячеек существующих строк, которые можно отправить до вставки новых"""
+        with self._lock:
+            new_rows_start = self._new_rows_start
+            if new_rows_start is None:
+                return len(self._updates)
+            return sum(1 for row, _ in self._updates if row < new_rows_start)
+
+    def flush_updates(self) -> int:
+        """Отправляет накопленные изменения существующих строк, не дожидаясь конца запуска.
+
+        Новые строки вставляются только в flush, поэтому до него номера существующих строк не меняются.
+        """
+        with self._lock:
+            new_rows_start = self._new_rows_start
+            updates = {
+                cell: value
+                for cell, value in self._updates.items()
+                if new_rows_start is None or cell[0] < new_rows_start
+            }
+            for cell in updates:
+                del self._updates[cell]
+
+        if not updates:
+            return 0
+
+        requests_count = self._send_ranges(self._build_ranges(updates))
+        logger.info("Flushed %s cells in %s requests", len(updates), requests_count)
+        return requests_count
+
+    def flush(self) -> int:
+        """Отправляет запланированные изменения и возвращает число выполненных запросов"""
+        with self._lock:
+            logger.info("Sheet diff: %s cells changed, %s cells unchanged", self.changed_cells, self.unchanged_cells)
+
+            requests_count = 0
+
+            # Новые строки вставляются первыми, а остальные ячейки переносятся на свои места после вставок
+            if self._new_rows:
+                requests_count += self._insert_new_rows()
+
+            requests_count += self._send_ranges(self._build_ranges(self._updates))
+
+            logger.info(
+                "Flushed %s cells and %s rows in %s requests", len(self._updates), len(self._new_rows), requests_count
+            )
+
+            self._updates.clear()
+            self._new_rows.clear()
+            self._new_row_targets.clear()
+            self._next_row = None
+
+            return requests_count
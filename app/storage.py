@@ -0,0 +1,297 @@
+import logging
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Iterable, Iterator
+
+from app.clinics_card.entities import (
+    Invoice,
+    Patient,
+    PatientAggregates,
+    Payment,
+    Plan,
+    Visit,
+    get_treatment_plan,
+)
+
+logger = logging.getLogger(__name__)
+
+# Колонки таблиц совпадают с полями сущностей, связи заполняются при чтении
+TABLE_COLUMNS = {
+    "patients": {
+        "id": "TEXT PRIMARY KEY",
+        "first_name": "TEXT",
+        "last_name": "TEXT",
+        "code": "INTEGER",
+        "curator": "TEXT",
+        "first_visit_date": "TEXT",
+        "last_visit_date": "TEXT",
+        "main_plans_id": "TEXT",
+    },
+    "plans": {
+        "id": "TEXT PRIMARY KEY",
+        "name": "TEXT",
+        "doctor_id": "TEXT",
+        "plan_total": "",
+        "plan_total_with_discount": "",
+    },
+    "visits": {
+        "id": "TEXT PRIMARY KEY",
+        "patient_id": "TEXT NOT NULL",
+        "status": "TEXT",
+        "doctor": "TEXT",
+        "date_created": "TEXT",
+        "visit_start": "TEXT",
+        "visit_end": "TEXT",
+    },
+    "payments": {
+        "id": "TEXT PRIMARY KEY",
+        "patient_id": "TEXT NOT NULL",
+        "amount": "",
+        "type": "TEXT",
+        "currency": "TEXT",
+        "status": "TEXT",
+        "date_created": "TEXT",
+    },
+    "invoices": {
+        "id": "TEXT PRIMARY KEY",
+        "patient_id": "TEXT NOT NULL",
+        "date_created": "TEXT",
+        "amount": "",
+        "purpose": "TEXT",
+    },
+}
+TABLE_ENTITIES = {
+    "patients": Patient,
+    "plans": Plan,
+    "visits": Visit,
+    "payments": Payment,
+    "invoices": Invoice,
+}
+PATIENT_TABLES = ["visits", "payments", "invoices"]
+DATETIME_COLUMNS = {("payments", "date_created"), ("invoices", "date_created")}
+KEY_COLUMNS = {"id", "patient_id", "main_plans_id"}
+
+
+class SnapshotStore:
+    """Локальный SQLite снимок сущностей ClinicsCard"""
+
+    def __init__(self, path: str):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self._create_schema()
+
+    def _create_schema(self):
+        with self.connection:
+            for table, columns in TABLE_COLUMNS.items():
+                columns_sql = ", ".join(f"{name} {column_type}".strip() for name, column_type in columns.items())
+                self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns_sql})")
+
+            for table in PATIENT_TABLES:
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_patient_id ON {table} (patient_id)")
+                self.connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS ix_{table}_date_created ON {table} (date_created)"
+                )
+
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_patients_first_visit_date ON patients (first_visit_date)"
+            )
+            self.connection.execute("CREATE TABLE IF NOT EXISTS watermarks (endpoint TEXT PRIMARY KEY, value TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS dirty_patients (patient_id TEXT PRIMARY KEY)")
+
+    @contextmanager
+    def transaction(self):
+        """Все записи в снимок выполняются внутри транзакции и фиксируются вместе"""
+        with self.connection:
+            yield self
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self) -> "SnapshotStore":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _to_row(self, table: str, entity) -> tuple:
+        row = []
+        for column in TABLE_COLUMNS[table]:
+            value = getattr(entity, column)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            elif column in KEY_COLUMNS and value is not None:
+                value = str(value)
+            row.append(value)
+        return tuple(row)
+
+    def _to_entity(self, table: str, row: sqlite3.Row):
+        values = dict(zip(row.keys(), row))
+        for column in TABLE_COLUMNS[table]:
+            if (table, column) in DATETIME_COLUMNS and values[column] is not None:
+                values[column] = datetime.fromisoformat(values[column])
+        return TABLE_ENTITIES[table](**values)
+
+    def upsert(self, table: str, entities: Iterable) -> set[str]:
+        """Пакетно вставляет или обновляет сущности.
+
+        Возвращает id пациентов измененных записей, а для таблиц пациентов и планов - id самих записей.
+        """
+        return self._merge(table, entities)
+
+    def replace(self, table: str, entities: Iterable, period: tuple[str, str] | None = None) -> set[str]:
+        """Приводит таблицу к загруженным сущностям: записи, которых нет в загрузке, удаляются.
+
+        С period сверяются только записи с датой создания в этом периоде (границы включительно).
+        Возвращает те же id, что и upsert, включая id удаленных записей.
+        """
+        return self._merge(table, entities, delete_missing=True, period=period)
+
+    def _merge(
+        self,
+        table: str,
+        entities: Iterable,
+        delete_missing: bool = False,
+        period: tuple[str, str] | None = None,
+    ) -> set[str]:
+        key = "patient_id" if table in PATIENT_TABLES else "id"
+        columns = list(TABLE_COLUMNS[table])
+        columns_sql = ", ".join(columns)
+        placeholders = ", ".join("?" for _ in columns)
+        changed_condition = " OR ".join(f"t.{column} IS NOT s.{column}" for column in columns if column != "id")
+        update_sql = ", ".join(f"{column} = excluded.{column}" for column in columns if column != "id")
+
+        self.connection.execute(f"DROP TABLE IF EXISTS temp.staged_{table}")
+        self.connection.execute(f"CREATE TEMP TABLE staged_{table} AS SELECT * FROM {table} WHERE 0")
+        self.connection.executemany(
+            f"INSERT INTO staged_{table} ({columns_sql}) VALUES ({placeholders})",
+            (self._to_row(table, entity) for entity in entities),
+        )
+
+        changed_ids = {
+            row[0]
+            for row in self.connection.execute(
+                f"SELECT DISTINCT s.{key} FROM staged_{table} s LEFT JOIN {table} t ON t.id = s.id "
+                f"WHERE t.id IS NULL OR {changed_condition}"
+            )
+        }
+
+        if delete_missing:
+            self.connection.execute(f"CREATE INDEX temp.ix_staged_{table}_id ON staged_{table} (id)")
+            missing_condition = f"NOT EXISTS (SELECT 1 FROM staged_{table} s WHERE s.id = {table}.id)"
+            params: tuple = ()
+            if period is not None:
+                # Даты хранятся строками ISO с временем или без, поэтому верхняя граница - начало следующего дня
+                missing_condition += " AND date_created >= ? AND date_created < ?"
+                params = (period[0], (date.fromisoformat(period[1]) + timedelta(days=1)).isoformat())
+
+            changed_ids.update(
+                row[0]
+                for row in self.connection.execute(f"SELECT {key} FROM {table} WHERE {missing_condition}", params)
+            )
+            deleted = self.connection.execute(f"DELETE FROM {table} WHERE {missing_condition}", params).rowcount
+            if deleted:
+                logger.info("Deleted %s %s missing from ClinicsCard", deleted, table)
+
+        # WHERE true нужен SQLite для разбора ON CONFLICT после INSERT ... SELECT
+        self.connection.execute(
+            f"INSERT INTO {table} ({columns_sql}) SELECT {columns_sql} FROM staged_{table} WHERE true "
+            f"ON CONFLICT(id) DO UPDATE SET {update_sql}"
+        )
+        self.connection.execute(f"DROP TABLE staged_{table}")
+
+        return changed_ids
+
+    def get_patient_ids_by_plan_ids(self, plan_ids: set[str]) -> set[str]:
+        if not plan_ids:
+            return set()
+
+        self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_ids (id TEXT PRIMARY KEY)")
+        self.connection.execute("DELETE FROM lookup_ids")
+        self.connection.executemany("INSERT INTO lookup_ids VALUES (?)", ((plan_id,) for plan_id in plan_ids))
+        rows = self.connection.execute(
+            "SELECT p.id FROM patients p JOIN lookup_ids l ON l.id = p.main_plans_id"
+        ).fetchall()
+
+        return {row[0] for row in rows}
+
+    def get_watermarks(self) -> dict[str, str]:
+        return {row["endpoint"]: row["value"] for row in self.connection.execute("SELECT * FROM watermarks")}
+
+    def set_watermark(self, endpoint: str, value: str):
+        self.connection.execute(
+            "INSERT INTO watermarks VALUES (?, ?) ON CONFLICT(endpoint) DO UPDATE SET value = excluded.value",
+            (endpoint, value),
+        )
+
+    def get_max_date_created(self, table: str) -> str | None:
+        return self.connection.execute(f"SELECT max(substr(date_created, 1, 10)) FROM {table}").fetchone()[0]
+
+    def mark_dirty_patients(self, patient_ids: Iterable[str]):
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO dirty_patients VALUES (?)", ((patient_id,) for patient_id in patient_ids)
+        )
+
+    def get_dirty_patient_ids(self) -> set[str]:
+        return {row[0] for row in self.connection.execute("SELECT patient_id FROM dirty_patients")}
+
+    def clear_dirty_patients(self):
+        self.connection.execute("DELETE FROM dirty_patients")
+
+    def log_orphans(self):
+        for table in PATIENT_TABLES:
+            orphans = self.connection.execute(
+                f"SELECT count(*) FROM {table} t LEFT JOIN patients p ON p.id = t.patient_id WHERE p.id IS NULL"
+            ).fetchone()[0]
+            if orphans:
+                logger.warning("%s %s refer to patients that do not exist", orphans, table)
+
+    def iter_patients(self) -> Iterator[Patient]:
+        """Отдает пациентов с первым визитом по порядку, подтягивая связанные записи индексными запросами"""
+        self.log_orphans()
+
+        doctors: dict[str, str] = {}
+        patient_rows = self.connection.execute(
+            "SELECT * FROM patients WHERE first_visit_date IS NOT NULL ORDER BY first_visit_date"
+        )
+        for patient_row in patient_rows:
+            patient = self._to_entity("patients", patient_row)
+
+            if patient.main_plans_id is not None:
+                plan_row = self.connection.execute(
+                    "SELECT * FROM plans WHERE id = ?", (patient.main_plans_id,)
+                ).fetchone()
+                patient.main_plans = self._to_entity("plans", plan_row) if plan_row else None
+
+            payment_rows = self.connection.execute(
+                "SELECT * FROM payments WHERE patient_id = ? ORDER BY date_created, rowid", (patient.id,)
+            )
+            patient.payments = [self._to_entity("payments", row) for row in payment_rows]
+
+            # Визиты и счета сразу раскладываем по колонкам, не создавая объект на каждую запись,
+            # и за тот же проход считаем показатели пациента
+            aggregates = PatientAggregates(treatment_plan=get_treatment_plan(patient.main_plans))
+            visit_rows = self.connection.execute(
+                "SELECT date_created, status, doctor FROM visits WHERE patient_id = ? ORDER BY date_created, rowid",
+                (patient.id,),
+            )
+            for date_created, status, doctor in visit_rows:
+                doctor = doctors.setdefault(doctor, doctor)
+                patient.visits.append(date_created, status, doctor)
+                aggregates.add_visit(status == "VISITED", doctor)
+
+            invoice_rows = self.connection.execute(
+                "SELECT date_created, amount FROM invoices WHERE patient_id = ? ORDER BY date_created, rowid",
+                (patient.id,),
+            )
+            for date_created, amount in invoice_rows:
+                patient.invoices.append(date_created, amount)
+                aggregates.add_invoice(patient.invoices.dates[-1], patient.invoices.amounts[-1])
+
+            patient.cached_aggregates = aggregates
+
+            yield patient
@@ -0,0 +1,97 @@
+import logging
+from datetime import date, timedelta
+from typing import Iterable
+
+from app.storage import SnapshotStore
+
+logger = logging.getLogger(__name__)
+
+PERIOD_ENDPOINTS = ["visits", "payments", "plans", "invoices"]
+# Статус визита и сумма плана меняются уже после создания записи, поэтому их окно перезагрузки длиннее
+MUTABLE_ENDPOINTS = {"visits", "plans"}
+# У планов в снимке нет даты создания, удаленные планы убирает только полная сверка
+DATED_ENDPOINTS = {"visits", "payments", "invoices"}
+FULL_SYNC_KEY = "full_sync"
+
+
+class SyncState:
+    """Водяные знаки последней синхронизации по каждому эндпоинту поверх локального снимка"""
+
+    def __init__(self, store: SnapshotStore):
+        self.store = store
+        self.watermarks = store.get_watermarks()
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.watermarks
+
+    def is_full_sync_due(self, today: date, every_days: int) -> bool:
+        """Полная сверка нужна для пустого снимка и раз в every_days дней (0 - только для пустого)"""
+        if self.is_empty:
+            return True
+        if every_days <= 0:
+            return False
+        last_full_sync = self.watermarks.get(FULL_SYNC_KEY)
+        return last_full_sync is None or (today - date.fromisoformat(last_full_sync)).days >= every_days
+
+    def get_date_from(
+        self,
+        default: str,
+        lookback_days: int = 0,
+        mutable_lookback_days: int = 0,
+        full: bool = False,
+    ) -> dict[str, str]:
+        """Возвращает начало периода загрузки для каждого эндпоинта с учетом запаса на поздние правки"""
+        date_from = {}
+        for endpoint in PERIOD_ENDPOINTS:
+            watermark = self.watermarks.get(endpoint)
+            if full or watermark is None:
+                date_from[endpoint] = default
+            else:
+                lookback = (
+                    max(lookback_days, mutable_lookback_days) if endpoint in MUTABLE_ENDPOINTS else lookback_days
+                )
+                start = date.fromisoformat(watermark) - timedelta(days=lookback)
+                date_from[endpoint] = max(start.isoformat(), default)
+        return date_from
+
+    def merge(
+        self, data: dict[str, Iterable], date_from: dict[str, str], date_to: str, full: bool = False
+    ) -> set[str]:
+        """Объединяет загруженные изменения со снимком и помечает пациентов, данные которых изменились.
+
+        Загруженное окно каждого эндпоинта заменяет записи снимка за тот же период, поэтому удаленные
+        в ClinicsCard записи тоже уходят. При полной сверке заменяются таблицы целиком.
+        """
+        changed_patient_ids: set[str] = set()
+
+        with self.store.transaction():
+            for endpoint, entities in data.items():
+                # Пациенты всегда загружаются полностью
+                if full or endpoint == "patients":
+                    changed_ids = self.store.replace(endpoint, entities)
+                elif endpoint in DATED_ENDPOINTS:
+                    changed_ids = self.store.replace(endpoint, entities, period=(date_from[endpoint], date_to))
+                else:
+                    changed_ids = self.store.upsert(endpoint, entities)
+                if endpoint == "plans":
+                    changed_ids = self.store.get_patient_ids_by_plan_ids(changed_ids)
+                changed_patient_ids.update(changed_ids)
+
+            for endpoint in PERIOD_ENDPOINTS:
+                # Для сущностей без даты создания (планы) водяной знак - дата последней загрузки
+                watermark = date_to if endpoint == "plans" else self.store.get_max_date_created(endpoint)
+                if watermark:
+                    self.store.set_watermark(endpoint, watermark)
+                    self.watermarks[endpoint] = watermark
+
+            if full:
+                self.store.set_watermark(FULL_SYNC_KEY, date_to)
+                self.watermarks[FULL_SYNC_KEY] = date_to
+
+            # Пометки сохраняются до успешной записи в таблицу, чтобы пережить падение синхронизации
+            self.store.mark_dirty_patients(changed_patient_ids)
+
+        logger.info("%s sync: %s patients changed", "Full" if full else "Incremental", len(changed_patient_ids))
+
+        return changed_patient_ids
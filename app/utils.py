@@ -1,54 +1,207 @@
+import asyncio
 import logging
+import random
 import threading
 import time
-from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from functools import wraps
+from typing import Callable
 
+import httpx
 from gspread.exceptions import APIError
 
+from app.metrics import metrics
+
 logger = logging.getLogger(__name__)
 
 
-def retry_request(retries=5, delay=10):
+class RetryPolicy:
+    """Экспоненциальная задержка с полным джиттером, учетом Retry-After и общим дедлайном"""
+
+    def __init__(
+        self,
+        retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        deadline: float = 300.0,
+        retry_statuses: tuple[int, ...] = (409, 429, 500, 502, 503, 504),
+    ):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_statuses = retry_statuses
+
+    def get_retry_info(self, error: Exception) -> tuple[bool, int | None, float | None]:
+        """Возвращает (можно ли повторить, HTTP статус, Retry-After в секундах)"""
+        if isinstance(error, httpx.TransportError):
+            return True, None, None
+
+        if isinstance(error, (APIError, httpx.HTTPStatusError)):
+            response = error.response
+            status_code = response.status_code
+            if status_code not in self.retry_statuses:
+                return False, status_code, None
+            return True, status_code, parse_retry_after(response.headers.get("Retry-After"))
+
+        return False, None, None
+
+    def get_delay(self, attempt: int, retry_after: float | None = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+def retry_request(policy: RetryPolicy | None = None):
+    """Повторяет запросы Google Sheets и ClinicsCard при временных ошибках.
+
+    Ожидание выполняется вне лимитера, а при 429 лимитер экземпляра (self.rate_limiter, если есть)
+    приостанавливается, чтобы остальные запросы тоже переждали.
+    """
+    policy = policy or DEFAULT_RETRY_POLICY
+
     def decorator(func):
+        @wraps(func)
         def wrapper(*args, **kwargs):
-            for attempt in range(retries):
+            started = time.monotonic()
+            for attempt in range(policy.retries + 1):
                 try:
                     return func(*args, **kwargs)
-                except APIError as e:
-                    if e.response.status_code in [500, 503, 409]:
-                        logger.warning("Retrying... (%s / %s) wait for %s secconds", attempt + 1, retries, delay)
-                        time.sleep(delay)
-                    else:
+                except Exception as e:
+                    retryable, status_code, retry_after = policy.get_retry_info(e)
+                    if not retryable or attempt == policy.retries:
                         raise
-            raise Exception("Max retries exceeded")
+
+                    delay = policy.get_delay(attempt, retry_after)
+                    if time.monotonic() - started + delay > policy.deadline:
+                        logger.warning("Retry deadline of %s seconds exceeded", policy.deadline)
+                        raise
+
+                    component = type(args[0]).__name__ if args else func.__module__
+                    metrics.add_retry(component, func.__name__, delay)
+
+                    rate_limiter = getattr(args[0], "rate_limiter", None) if args else None
+                    if status_code == 429 and rate_limiter is not None:
+                        rate_limiter.pause(delay)
+
+                    logger.warning(
+                        "%s failed with %s, retrying... (%s / %s) wait for %.1f seconds",
+                        func.__name__,
+                        status_code or type(e).__name__,
+                        attempt + 1,
+                        policy.retries,
+                        delay,
+                    )
+                    time.sleep(delay)
 
         return wrapper
 
     return decorator
 
 
-def rate_limit(max_requests=60, per_seconds=60):
-    lock = threading.Lock()
-    requests_timestamps = deque(maxlen=max_requests)
+class TokenBucket:
+    """Потокобезопасный token bucket с поддержкой всплесков и запросов разного веса.
 
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            with lock:
-                current_time = time.time()
+    Токены резервируются под коротким локом, а ожидание выполняется уже без него, поэтому
+    один медленный запрос не блокирует остальные потоки и корутины.
+    """
+
+    def __init__(self, max_requests: int = 60, per_seconds: float = 60, burst: int = 10):
+        if not 0 < burst < max_requests:
+            raise ValueError("Burst must be positive and less than max_requests")
+
+        self.capacity = burst
+        # Скорость выбираем так, чтобы даже с учетом всплеска за любые per_seconds было не больше max_requests
+        self.rate = (max_requests - burst) / per_seconds
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.acquired = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def _reserve(self, cost: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            if now > self._updated:
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+            self._tokens -= cost
+            self.acquired += 1
+
+            wait = max(0.0, self._updated - now) + (-self._tokens / self.rate if self._tokens < 0 else 0.0)
+            if wait:
+                self.waits += 1
+                self.wait_seconds += wait
+            return wait
 
-                while requests_timestamps and current_time - requests_timestamps[0] >= per_seconds:
-                    requests_timestamps.popleft()
+    def pause(self, seconds: float):
+        """Останавливает выдачу токенов на заданное время (например, после ответа 429)"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._tokens, 0.0)
+            self._updated = max(self._updated, now + seconds)
 
-                if len(requests_timestamps) >= max_requests:
-                    sleep_time = requests_timestamps[0] + per_seconds - current_time
-                    if sleep_time > 0:
-                        time.sleep(sleep_time)
+    def acquire(self, cost: float = 1) -> float:
+        """Ждет, пока хватит токенов, и возвращает время ожидания в секундах"""
+        wait = self._reserve(cost)
+        if wait:
+            logger.debug("Rate limit reached, waiting %.2f seconds", wait)
+            time.sleep(wait)
+        return wait
 
-                requests_timestamps.append(time.time())
+    async def acquire_async(self, cost: float = 1):
+        wait = self._reserve(cost)
+        if wait:
+            logger.debug("Rate limit reached, waiting %.2f seconds", wait)
+            await asyncio.sleep(wait)
 
-                return func(*args, **kwargs)
+    @property
+    def metrics(self) -> dict[str, float]:
+        return {"acquired": self.acquired, "waits": self.waits, "wait_seconds": round(self.wait_seconds, 3)}
+
+
+_rate_limiters: dict[str, TokenBucket] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(key: str, max_requests: int = 60, per_seconds: float = 60, burst: int = 10) -> TokenBucket:
+    """Возвращает общий лимитер для ключа (например, учетной записи), создавая его при первом обращении"""
+    with _rate_limiters_lock:
+        if key not in _rate_limiters:
+            _rate_limiters[key] = TokenBucket(max_requests=max_requests, per_seconds=per_seconds, burst=burst)
+        return _rate_limiters[key]
+
+
+def rate_limit(cost: float | Callable[..., float] = 1):
+    """Списывает токены из лимитера экземпляра (self.rate_limiter) перед вызовом метода"""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            request_cost = cost(self, *args, **kwargs) if callable(cost) else cost
+            wait = self.rate_limiter.acquire(request_cost)
+            if wait:
+                metrics.add_wait(type(self).__name__, func.__name__, wait)
+            return func(self, *args, **kwargs)
 
         return wrapper
 
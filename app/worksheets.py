@@ -0,0 +1,345 @@
+import csv
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Protocol
+
+import httpx
+from gspread.cell import Cell
+from gspread.exceptions import APIError
+from gspread.utils import InsertDataOption, a1_range_to_grid_range, a1_to_rowcol
+
+from app.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+class WorksheetBackend(Protocol):
+    """Методы gspread.Worksheet, которыми пользуется GoogleSheetsClient"""
+
+    id: int
+    spreadsheet: "SpreadsheetBackend"
+
+    def get_all_values(self) -> list[list[str]]: ...
+
+    def get_values(self, range_name: str) -> list[list[str]]: ...
+
+    def col_values(self, col: int) -> list[str]: ...
+
+    def row_values(self, row: int) -> list[str]: ...
+
+    def find(self, query: str, in_row: int | None = None, in_column: int | None = None) -> Cell | None: ...
+
+    def findall(self, query: str, in_row: int | None = None, in_column: int | None = None) -> list[Cell]: ...
+
+    def insert_row(self, values: list, index: int = 1): ...
+
+    def update_cells(self, cell_list: list[Cell]): ...
+
+    def batch_update(self, data: list[dict]): ...
+
+
+class SpreadsheetBackend(Protocol):
+    """Структурные запросы к таблице (gspread.Spreadsheet)"""
+
+    def batch_update(self, body: dict) -> dict: ...
+
+
+class RequestQuota:
+    """Имитация квоты Google Sheets: не больше max_requests запросов за окно per_seconds, иначе ответ 429"""
+
+    def __init__(self, max_requests: int = 60, per_seconds: float = 60):
+        self.max_requests = max_requests
+        self.per_seconds = per_seconds
+        self._window_started = time.monotonic()
+        self._requests = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def check(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_started >= self.per_seconds:
+                self._window_started = now
+                self._requests = 0
+
+            if self._requests >= self.max_requests:
+                self.rejected += 1
+                retry_after = self.per_seconds - (now - self._window_started)
+                raise APIError(
+                    httpx.Response(
+                        429,
+                        headers={"Retry-After": f"{retry_after:.3f}"},
+                        json={"error": {"code": 429, "message": "Quota exceeded", "status": "RESOURCE_EXHAUSTED"}},
+                    )
+                )
+            self._requests += 1
+
+
+def to_cell_value(value: Any) -> str:
+    """Приводит значение к строке так же, как ее вернет Google Sheets для RAW-записи"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return str(value).upper()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class MemorySpreadsheet:
+    """Таблица из одного листа в памяти: выполняет запросы spreadsheets.batchUpdate"""
+
+    def __init__(self, worksheet: "MemoryWorksheet"):
+        self.worksheet = worksheet
+
+    def batch_update(self, body: dict) -> dict:
+        return self.worksheet.apply_requests(body["requests"])
+
+
+class MemoryWorksheet:
+    """Лист в памяти с семантикой gspread.Worksheet для локальных прогонов и бенчмарков.
+
+    Каждый вызов считается одним запросом к API: учитывается в calls, проходит через
+    квоту (если задана) и может ждать latency секунд, как сетевой запрос.
+    """
+
+    def __init__(
+        self,
+        values: list[list] | None = None,
+        quota: RequestQuota | None = None,
+        latency: float = 0.0,
+        title: str = "memory",
+    ):
+        self.title = title
+        self.values: list[list[str]] = [[to_cell_value(value) for value in row] for row in values or []]
+        self.quota = quota
+        self.latency = latency
+        self.id = 0
+        self.spreadsheet = MemorySpreadsheet(self)
+        self.calls: Counter[str] = Counter()
+        self._lock = threading.RLock()
+
+    def _request(self, method: str):
+        self.calls[method] += 1
+        if self.quota is not None:
+            self.quota.check()
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _on_change(self):
+        """Вызывается после изменения значений"""
+
+    @property
+    def row_count(self) -> int:
+        return len(self.values)
+
+    @property
+    def col_count(self) -> int:
+        return max((len(row) for row in self.values), default=0)
+
+    def _get_cell(self, row: int, col: int) -> str:
+        if row > len(self.values):
+            return ""
+        row_values = self.values[row - 1]
+        return row_values[col - 1] if col <= len(row_values) else ""
+
+    def _set_cell(self, row: int, col: int, value: Any):
+        while len(self.values) < row:
+            self.values.append([])
+        row_values = self.values[row - 1]
+        if len(row_values) < col:
+            row_values.extend([""] * (col - len(row_values)))
+        row_values[col - 1] = to_cell_value(value)
+
+    def _get_range(self, start_row: int, end_row: int, start_col: int, end_col: int) -> list[list[str]]:
+        # Как и API, отбрасываем пустые строки и колонки в конце диапазона, а строки выравниваем по ширине
+        rows = [
+            [self._get_cell(row, col) for col in range(start_col, end_col + 1)]
+            for row in range(start_row, min(end_row, len(self.values)) + 1)
+        ]
+        while rows and not any(rows[-1]):
+            rows.pop()
+        width = max((max((col for col, value in enumerate(row, 1) if value), default=0) for row in rows), default=0)
+        return [row[:width] for row in rows]
+
+    @staticmethod
+    def _trim(values: list[str]) -> list[str]:
+        values = list(values)
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def get_all_values(self) -> list[list[str]]:
+        with self._lock:
+            self._request("get_all_values")
+            return self._get_range(1, len(self.values), 1, self.col_count)
+
+    def get_values(self, range_name: str) -> list[list[str]]:
+        with self._lock:
+            self._request("get_values")
+            grid_range = a1_range_to_grid_range(range_name)
+            return self._get_range(
+                grid_range.get("startRowIndex", 0) + 1,
+                grid_range.get("endRowIndex", len(self.values)),
+                grid_range.get("startColumnIndex", 0) + 1,
+                grid_range.get("endColumnIndex", self.col_count),
+            )
+
+    def col_values(self, col: int) -> list[str]:
+        with self._lock:
+            self._request("col_values")
+            return self._trim(self._get_cell(row, col) for row in range(1, len(self.values) + 1))
+
+    def row_values(self, row: int) -> list[str]:
+        with self._lock:
+            self._request("row_values")
+            return self._trim(self.values[row - 1]) if row <= len(self.values) else []
+
+    def _findall(self, query, in_row: int | None, in_column: int | None) -> list[Cell]:
+        if isinstance(query, re.Pattern):
+            match = query.fullmatch
+        else:
+            query = str(query)
+
+            def match(value):
+                return value == query
+
+        cells = []
+        for row, row_values in enumerate(self.values, start=1):
+            if in_row and row != in_row:
+                continue
+            for col, value in enumerate(row_values, start=1):
+                if in_column and col != in_column:
+                    continue
+                if value != "" and match(value):
+                    cells.append(Cell(row=row, col=col, value=value))
+        return cells
+
+    def find(self, query, in_row: int | None = None, in_column: int | None = None) -> Cell | None:
+        with self._lock:
+            self._request("find")
+            cells = self._findall(query, in_row, in_column)
+            return cells[0] if cells else None
+
+    def findall(self, query, in_row: int | None = None, in_column: int | None = None) -> list[Cell]:
+        with self._lock:
+            self._request("findall")
+            return self._findall(query, in_row, in_column)
+
+    def _insert_rows(self, values: list[list], row: int):
+        while len(self.values) < row - 1:
+            self.values.append([])
+        self.values[row - 1 : row - 1] = [[to_cell_value(value) for value in row_values] for row_values in values]
+
+    def insert_row(self, values: list, index: int = 1, **kwargs):
+        with self._lock:
+            self._request("insert_row")
+            self._insert_rows([values], index)
+            self._on_change()
+
+    def insert_rows(self, values: list[list], row: int = 1, **kwargs):
+        with self._lock:
+            self._request("insert_rows")
+            self._insert_rows(values, row)
+            self._on_change()
+
+    def append_rows(self, values: list[list], insert_data_option=None, table_range: str | None = None, **kwargs):
+        """Добавляет строки начиная со строки table_range (или после последней строки листа)"""
+        with self._lock:
+            self._request("append_rows")
+            start_row = a1_to_rowcol(table_range)[0] if table_range else len(self.values) + 1
+            if insert_data_option == InsertDataOption.insert_rows:
+                self._insert_rows(values, start_row)
+            else:
+                for offset, row_values in enumerate(values):
+                    for col, value in enumerate(row_values, start=1):
+                        self._set_cell(start_row + offset, col, value)
+            self._on_change()
+
+    def update_cells(self, cell_list: list[Cell], **kwargs):
+        with self._lock:
+            self._request("update_cells")
+            for cell in cell_list:
+                self._set_cell(cell.row, cell.col, cell.value)
+            self._on_change()
+
+    def batch_update(self, data: list[dict], **kwargs):
+        with self._lock:
+            self._request("batch_update")
+            for value_range in data:
+                grid_range = a1_range_to_grid_range(value_range["range"])
+                for row_offset, row_values in enumerate(value_range["values"]):
+                    for col_offset, value in enumerate(row_values):
+                        self._set_cell(
+                            grid_range["startRowIndex"] + row_offset + 1,
+                            grid_range["startColumnIndex"] + col_offset + 1,
+                            value,
+                        )
+            self._on_change()
+
+    def apply_requests(self, requests: list[dict]) -> dict:
+        """Выполняет структурные запросы одним обращением, поддерживается только вставка строк"""
+        with self._lock:
+            self._request("spreadsheet_batch_update")
+            for request in requests:
+                insert = request.get("insertDimension")
+                if insert is None or insert["range"]["dimension"] != "ROWS":
+                    raise ValueError(f"Unsupported spreadsheet request: {request}")
+                if insert["range"].get("sheetId", self.id) != self.id:
+                    raise ValueError(f"Unknown sheet id: {insert['range']['sheetId']}")
+
+                start, end = insert["range"]["startIndex"], insert["range"]["endIndex"]
+                self._insert_rows([[] for _ in range(end - start)], start + 1)
+            self._on_change()
+            return {"replies": [{} for _ in requests]}
+
+
+class FileWorksheet(MemoryWorksheet):
+    """Лист, сохраняемый в локальный файл CSV или JSON после каждого изменения"""
+
+    def __init__(self, path: str, quota: RequestQuota | None = None, latency: float = 0.0, autosave: bool = True):
+        self.path = path
+        self.autosave = autosave
+        super().__init__(values=self._load(), quota=quota, latency=latency, title=os.path.basename(path))
+
+    @property
+    def is_csv(self) -> bool:
+        return self.path.lower().endswith(".csv")
+
+    def _load(self) -> list[list]:
+        if not os.path.exists(self.path):
+            return []
+
+        with open(self.path, encoding="utf-8", newline="") as file:
+            if self.is_csv:
+                return list(csv.reader(file))
+            return json.load(file)
+
+    def save(self):
+        with atomic_write(self.path, newline="") as file:
+            if self.is_csv:
+                csv.writer(file).writerows(self.values)
+            else:
+                json.dump(self.values, file, ensure_ascii=False)
+
+    def _on_change(self):
+        if self.autosave:
+            self.save()
+
+
+def open_local_worksheet(
+    path: str | None = None,
+    max_requests: int | None = None,
+    per_seconds: float = 60,
+    latency: float = 0.0,
+) -> MemoryWorksheet:
+    """Открывает локальный лист: из файла, если указан path, иначе пустой лист в памяти"""
+    quota = RequestQuota(max_requests=max_requests, per_seconds=per_seconds) if max_requests else None
+    if path:
+        return FileWorksheet(path, quota=quota, latency=latency)
+    return MemoryWorksheet(quota=quota, latency=latency)
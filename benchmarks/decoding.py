@@ -0,0 +1,79 @@
+"""Сравнение стандартного и быстрого (msgspec) декодирования ответа /invoices и /payments.
+
+Запуск: python -m benchmarks.decoding --rows 1000000
+"""
+
+import argparse
+import json
+import random
+import time
+from datetime import date, timedelta
+
+from httpx import Client
+
+from app.clinics_card.decoding import FAST_DECODERS, FAST_DECODING_AVAILABLE
+from app.clinics_card.invoices import ClinicsCardInvoice
+from app.clinics_card.payments import ClinicsCardPayment
+
+
+def generate_invoices(rows: int) -> bytes:
+    start = date(2023, 1, 1)
+    data = [
+        {
+            "id": str(i),
+            "patient_id": str(random.randint(1, rows // 10 + 1)),
+            "purpose": random.choice(["SERVICE", "SERVICE", "SERVICE", "PREINVOICE"]),
+            "amount": f"{random.randint(100, 50000)}.00",
+            "date_created": (start + timedelta(days=random.randint(0, 900))).isoformat(),
+        }
+        for i in range(rows)
+    ]
+    return json.dumps({"data": data}).encode()
+
+
+def generate_payments(rows: int) -> bytes:
+    start = date(2023, 1, 1)
+    data = [
+        {
+            "payment_id": str(i),
+            "patient_id": str(random.randint(1, rows // 10 + 1)),
+            "amount": f"{random.randint(100, 50000)}.00",
+            "type": "CASH",
+            "date_created": f"{(start + timedelta(days=random.randint(0, 900))).isoformat()} 12:30:00",
+            "cash_desk": {"currency": "UAH", "status": "ACTIVE"} if i % 2 else None,
+        }
+        for i in range(rows)
+    ]
+    return json.dumps({"data": data}).encode()
+
+
+def measure(name: str, decode, content: bytes):
+    started = time.perf_counter()
+    entities = decode(content)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<24} {elapsed:8.3f}s {len(entities) / elapsed:12,.0f} rows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    http_client = Client()
+    invoice_client = ClinicsCardInvoice(http_client=http_client, api_key="benchmark")
+    payment_client = ClinicsCardPayment(http_client=http_client, api_key="benchmark")
+
+    for endpoint, content, parse in (
+        ("/invoices", generate_invoices(args.rows), invoice_client._parse_invoices),
+        ("/payments", generate_payments(args.rows), payment_client._parse_payments),
+    ):
+        print(f"{endpoint}: {args.rows:,} rows, {len(content) / 2**20:.1f} MiB")
+        measure("standard", lambda content: parse(json.loads(content)["data"]), content)
+        if FAST_DECODING_AVAILABLE:
+            measure("msgspec", FAST_DECODERS[endpoint], content)
+        else:
+            print("msgspec is not installed, fast path skipped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Сравнение последовательной и одновременной загрузки данных ClinicsCard на локальном stub сервере.
+
+Запуск: python -m benchmarks.fetch_concurrency --delay 0.5
+"""
+
+import argparse
+import logging
+import os
+import time
+
+from benchmarks.stub_server import run_stub_server
+
+PAYLOADS = {
+    "patients": [
+        {
+            "patient_id": "1",
+            "firstname": "Иван",
+            "lastname": "Иванов",
+            "first_visit_date": "2024-01-10",
+            "last_visit_date": "2024-02-10",
+            "code": "1",
+            "curator": "",
+            "main_plans_id": "1",
+        }
+    ],
+    "visits": [
+        {
+            "visit_id": "1",
+            "patient_id": "1",
+            "status": "VISITED",
+            "doctor": "Доктор",
+            "date_created": "2024-01-10",
+            "visit_start": None,
+            "visit_end": None,
+        }
+    ],
+    "payments": [
+        {
+            "payment_id": "1",
+            "patient_id": "1",
+            "amount": "100.00",
+            "type": "CASH",
+            "date_created": "2024-01-10 10:00:00",
+            "cash_desk": None,
+        }
+    ],
+    "plans": [
+        {
+            "plan_id": "1",
+            "plan_name": "План",
+            "doctor_id": "1",
+            "plan_total": "1000.00",
+            "plan_total_with_discount": "900.00",
+        }
+    ],
+    "invoices": [
+        {"id": "1", "patient_id": "1", "purpose": "SERVICE", "amount": "100.00", "date_created": "2024-01-10"}
+    ],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--delay", type=float, default=0.5, help="задержка ответа stub сервера в секундах")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    with run_stub_server(payloads=PAYLOADS, delay=args.delay) as server:
+        os.environ["CLINICS_CARD_BASE_URL"] = server.base_url
+        os.environ.setdefault("CLINICS_CARD_API_KEY", "benchmark")
+        os.environ.setdefault("GOOGLE_SPREADSHEET_KEY", "benchmark")
+        os.environ.setdefault("GOOGLE_WORKSHEET_NAME", "benchmark")
+
+        from app.__main__ import create_clinics_card_transport, fetch_clinics_card_data
+
+        for concurrent in (False, True):
+            timings = []
+            with create_clinics_card_transport() as transport:
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    fetch_clinics_card_data(transport=transport, concurrent=concurrent)
+                    timings.append(time.perf_counter() - started)
+
+            mode = "concurrent" if concurrent else "sequential"
+            print(f"{mode:<12} best={min(timings):.3f}s mean={sum(timings) / len(timings):.3f}s")
+
+
+if __name__ == "__main__":
+    main()
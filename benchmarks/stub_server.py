@@ -0,0 +1,80 @@
+import bisect
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubClinicsCardServer(ThreadingHTTPServer):
+    """Локальный HTTP сервер, отдающий заранее подготовленные ответы ClinicsCard"""
+
+    daemon_threads = True
+
+    def __init__(self, payloads: dict[str, list[dict]], delay: float = 0.0):
+        super().__init__(("127.0.0.1", 0), StubClinicsCardHandler)
+        self.payloads = payloads
+        self.delay = delay
+        self.requests: Counter[str] = Counter()
+        self._requests_lock = threading.Lock()
+
+        # Записи с date_created отдаются по периоду from/to, как это делает ClinicsCard
+        self._dates: dict[str, list[str]] = {}
+        for endpoint, items in payloads.items():
+            if items and all("date_created" in item for item in items):
+                items.sort(key=lambda item: item["date_created"])
+                self._dates[endpoint] = [item["date_created"][:10] for item in items]
+
+    def get_items(self, endpoint: str, date_from: str | None, date_to: str | None) -> list[dict]:
+        with self._requests_lock:
+            self.requests[endpoint] += 1
+
+        items = self.payloads[endpoint]
+        dates = self._dates.get(endpoint)
+        if dates is None or date_from is None or date_to is None:
+            return items
+        return items[bisect.bisect_left(dates, date_from) : bisect.bisect_right(dates, date_to)]
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+
+class StubClinicsCardHandler(BaseHTTPRequestHandler):
+    server: StubClinicsCardServer
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        endpoint = url.path.removeprefix("/api/").strip("/")
+        if endpoint not in self.server.payloads:
+            self.send_error(404)
+            return
+
+        time.sleep(self.server.delay)
+
+        query = parse_qs(url.query)
+        items = self.server.get_items(endpoint, query.get("from", [None])[0], query.get("to", [None])[0])
+        body = json.dumps({"data": items}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def run_stub_server(payloads: dict[str, list[dict]], delay: float = 0.0):
+    server = StubClinicsCardServer(payloads=payloads, delay=delay)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,360 @@
+"""Нагрузочный прогон полной синхронизации на синтетических данных ClinicsCard.
+
+Для каждого размера генерируются пациенты с пропорциональными визитами, оплатами и счетами,
+данные отдаются локальным stub сервером, а запись идет в лист в памяти. Генерация данных и stub
+сервер работают в отдельном процессе, а синхронизация - в своем, поэтому ее пиковая память
+не включает синтетические данные и тела ответов. Результаты дописываются в --results
+и сравниваются с предыдущим прогоном того же размера.
+
+Запуск: python -m benchmarks.sync_pipeline --patients 1000 10000 100000
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from benchmarks.stub_server import run_stub_server
+
+VISITS_PER_PATIENT = 5
+PAYMENTS_PER_PATIENT = 3
+INVOICES_PER_PATIENT = 3
+# Пациенты с младшими кодами уже есть на листе, старшие добавляются в конец как новые,
+# а небольшая доля пропущенных в середине вставляется между существующими
+EXISTING_PATIENTS_SHARE = 0.8
+MISSING_PATIENTS_SHARE = 0.005
+# Первая колонка сетки оплат на листе
+PAYMENT_GRID_COLUMN = 12
+FIRST_PATIENT_ROW = 5
+PERIOD_START = date(2023, 1, 1)
+PERIOD_END = date(2025, 12, 31)
+
+DEFAULT_RESULTS_PATH = "benchmarks/results/sync_pipeline.jsonl"
+
+
+def random_date(rng: random.Random) -> date:
+    return PERIOD_START + timedelta(days=rng.randint(0, (PERIOD_END - PERIOD_START).days))
+
+
+def generate_payloads(patients: int, seed: int = 0) -> dict[str, list[dict]]:
+    rng = random.Random(seed)
+    doctors = [f"Доктор {i}" for i in range(max(patients // 200, 5))]
+    curators = [f"Куратор {i}" for i in range(max(patients // 500, 3))]
+
+    payloads = {"patients": [], "visits": [], "payments": [], "plans": [], "invoices": []}
+    for patient_id in range(1, patients + 1):
+        first_visit_date = random_date(rng)
+        payloads["patients"].append(
+            {
+                "patient_id": str(patient_id),
+                "firstname": f"Имя{patient_id}",
+                "lastname": f"Фамилия{patient_id}",
+                "first_visit_date": first_visit_date.isoformat(),
+                "last_visit_date": first_visit_date.isoformat(),
+                "code": str(patient_id * 3),
+                "curator": rng.choice(curators),
+                "main_plans_id": str(patient_id),
+            }
+        )
+        payloads["plans"].append(
+            {
+                "plan_id": str(patient_id),
+                "plan_name": "План лечения",
+                "doctor_id": "1",
+                "plan_total": f"{rng.randint(1000, 100000)}.00",
+                "plan_total_with_discount": f"{rng.randint(1000, 100000)}.00",
+                "date_created": first_visit_date.isoformat(),
+            }
+        )
+
+        for _ in range(rng.randint(0, VISITS_PER_PATIENT * 2)):
+            payloads["visits"].append(
+                {
+                    "visit_id": str(len(payloads["visits"]) + 1),
+                    "patient_id": str(patient_id),
+                    "status": rng.choice(["VISITED", "VISITED", "VISITED", "CANCELED"]),
+                    "doctor": rng.choice(doctors),
+                    "date_created": random_date(rng).isoformat(),
+                    "visit_start": None,
+                    "visit_end": None,
+                }
+            )
+        for _ in range(rng.randint(0, PAYMENTS_PER_PATIENT * 2)):
+            payloads["payments"].append(
+                {
+                    "payment_id": str(len(payloads["payments"]) + 1),
+                    "patient_id": str(patient_id),
+                    "amount": f"{rng.randint(100, 50000)}.00",
+                    "type": "CASH",
+                    "date_created": f"{random_date(rng).isoformat()} 12:30:00",
+                    "cash_desk": {"currency": "UAH", "status": "ACTIVE"},
+                }
+            )
+        for _ in range(rng.randint(0, INVOICES_PER_PATIENT * 2)):
+            payloads["invoices"].append(
+                {
+                    "id": str(len(payloads["invoices"]) + 1),
+                    "patient_id": str(patient_id),
+                    "purpose": rng.choice(["SERVICE", "SERVICE", "SERVICE", "PREINVOICE"]),
+                    "amount": f"{rng.randint(100, 50000)}.00",
+                    "date_created": random_date(rng).isoformat(),
+                }
+            )
+
+    return payloads
+
+
+def generate_sheet(payloads: dict[str, list[dict]], seed: int = 0) -> list[list]:
+    """Строит лист с шапкой сетки оплат и частью пациентов, отсортированных по коду"""
+    from app.calendar_layout import DATE_ROW, days_in_half_year_up_to, iter_half_year_dates
+
+    rng = random.Random(seed)
+    header_rows = [[""] * PAYMENT_GRID_COLUMN for _ in range(FIRST_PATIENT_ROW - 1)]
+    header_rows[0][2] = "ФИО"
+    header_rows[0][3] = "Код"
+
+    col = PAYMENT_GRID_COLUMN
+    for year in range(PERIOD_START.year, PERIOD_END.year + 1):
+        for half in (1, 2):
+            dates = list(iter_half_year_dates(year, half))
+            width = days_in_half_year_up_to(year, half, dates[-1].month, dates[-1].day)
+            for row in header_rows:
+                row.extend([""] * width)
+            header_rows[0][col - 1] = f"{half} полугодие {year}"
+            for target_date in dates:
+                d_index = days_in_half_year_up_to(year, half, target_date.month, target_date.day)
+                header_rows[DATE_ROW - 1][col + d_index - 2] = target_date.strftime("%d.%m")
+            col += width
+
+    patients = sorted(payloads["patients"], key=lambda patient: int(patient["code"]))
+    patients = [
+        patient
+        for patient in patients[: int(len(patients) * EXISTING_PATIENTS_SHARE)]
+        if rng.random() >= MISSING_PATIENTS_SHARE
+    ]
+    patient_rows = [
+        ["", "", f"{patient['lastname']} {patient['firstname']}", patient["code"], patient["curator"]]
+        for patient in patients
+    ]
+    return header_rows + patient_rows
+
+
+def get_current_rss_mb() -> float:
+    """Текущий RSS процесса, без /proc - пиковый"""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        return get_peak_rss_mb()
+
+
+def get_peak_rss_mb() -> float:
+    # На Linux ru_maxrss в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def serve(patients: int, sheet_path: str, delay: float):
+    """Генерирует данные, сохраняет стартовый лист в sheet_path и отдает данные stub сервером.
+
+    Первой строкой печатает адрес сервера, после закрытия stdin - число запросов по эндпоинтам.
+    """
+    payloads = generate_payloads(patients)
+    with open(sheet_path, "w", encoding="utf-8") as file:
+        json.dump(generate_sheet(payloads), file, ensure_ascii=False)
+    entities = {endpoint: len(items) for endpoint, items in payloads.items()}
+
+    with run_stub_server(payloads=payloads, delay=delay) as server:
+        print(json.dumps({"base_url": server.base_url, "entities": entities}), flush=True)
+        sys.stdin.read()
+        print(json.dumps({"clinics_card_requests": dict(server.requests)}), flush=True)
+
+
+def run_single(patients: int, base_url: str, sheet_path: str) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["CLINICS_CARD_BASE_URL"] = base_url
+        os.environ["SNAPSHOT_DB_PATH"] = os.path.join(tmp_dir, "snapshot.sqlite3")
+        os.environ["PAYMENT_CALENDAR_PATH"] = os.path.join(tmp_dir, "payment_calendar.json")
+        os.environ.setdefault("CLINICS_CARD_API_KEY", "benchmark")
+        os.environ.setdefault("GOOGLE_SPREADSHEET_KEY", "benchmark")
+        os.environ.setdefault("GOOGLE_WORKSHEET_NAME", "benchmark")
+
+        from app.__main__ import get_all_patient_data, inser_not_exist_patients_excel
+        from app.config import settings
+        from app.excel import GoogleSheetsClient
+        from app.storage import SnapshotStore
+        from app.worksheets import MemoryWorksheet, RequestQuota
+
+        with open(sheet_path, encoding="utf-8") as file:
+            worksheet = MemoryWorksheet(
+                json.load(file),
+                quota=RequestQuota(settings.GOOGLE_RATE_LIMIT_REQUESTS, settings.GOOGLE_RATE_LIMIT_PERIOD),
+            )
+        sheet_rows_before = worksheet.row_count
+        google_sheet_client = GoogleSheetsClient(
+            google_sheets_key=settings.GOOGLE_SPREADSHEET_KEY,
+            worksheet_name=f"benchmark-{patients}",
+            token_path="",
+            max_requests=settings.GOOGLE_RATE_LIMIT_REQUESTS,
+            per_seconds=settings.GOOGLE_RATE_LIMIT_PERIOD,
+            burst=settings.GOOGLE_RATE_LIMIT_BURST,
+            worksheet=worksheet,
+        )
+
+        # Лист в памяти заменяет Google Sheets и в прирост памяти синхронизации не входит
+        rss_before = get_current_rss_mb()
+        timings = {}
+        started = time.perf_counter()
+        with SnapshotStore(settings.SNAPSHOT_DB_PATH) as store:
+            patients_iter = get_all_patient_data(store=store)
+            timings["fetch"] = time.perf_counter() - started
+
+            sheet_started = time.perf_counter()
+            inser_not_exist_patients_excel(patients=patients_iter, google_sheet_client=google_sheet_client)
+            timings["sheet"] = time.perf_counter() - sheet_started
+        timings["total"] = time.perf_counter() - started
+        peak_rss = get_peak_rss_mb()
+
+        return {
+            "patients": patients,
+            "sheet_rows": {"before": sheet_rows_before, "after": worksheet.row_count},
+            "wall_seconds": {name: round(value, 3) for name, value in timings.items()},
+            "peak_rss_mb": round(peak_rss, 1),
+            "sync_rss_growth_mb": round(max(0.0, peak_rss - rss_before), 1),
+            "sheets_requests": dict(worksheet.calls),
+            "sheets_quota_rejected": worksheet.quota.rejected,
+            "rate_limiter": google_sheet_client.rate_limiter.metrics,
+        }
+
+
+def run_benchmark(patients: int, delay: float) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sheet_path = os.path.join(tmp_dir, "sheet.json")
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.sync_pipeline",
+                "--serve",
+                str(patients),
+                "--sheet",
+                sheet_path,
+                "--delay",
+                str(delay),
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        try:
+            server_info = json.loads(server.stdout.readline())
+            process = subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.sync_pipeline",
+                    "--single",
+                    str(patients),
+                    "--base-url",
+                    server_info["base_url"],
+                    "--sheet",
+                    sheet_path,
+                ],
+                capture_output=True,
+                text=True,
+            )
+            server_stats, _ = server.communicate()
+        finally:
+            if server.poll() is None:
+                server.kill()
+                server.wait()
+
+    if process.returncode != 0:
+        print(process.stderr, file=sys.stderr)
+        raise SystemExit(f"Benchmark for {patients} patients failed")
+
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result["entities"] = server_info["entities"]
+    result.update(json.loads(server_stats.strip().splitlines()[-1]))
+    return result
+
+
+def get_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_previous_results(path: str) -> dict[int, dict]:
+    previous = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                result = json.loads(line)
+                previous[result["patients"]] = result
+    return previous
+
+
+def print_result(result: dict, previous: dict | None):
+    total = result["wall_seconds"]["total"]
+    line = (
+        f"{result['patients']:>8} patients  total={total:8.2f}s  fetch={result['wall_seconds']['fetch']:8.2f}s  "
+        f"sheet={result['wall_seconds']['sheet']:8.2f}s  peak={result['peak_rss_mb']:8.1f}MB  "
+        f"sync_growth={result['sync_rss_growth_mb']:8.1f}MB  "
+        f"clinics_card={sum(result['clinics_card_requests'].values())}  "
+        f"sheets={sum(result['sheets_requests'].values())}  "
+        f"limiter_wait={result['rate_limiter']['wait_seconds']}s"
+    )
+    if previous is not None:
+        change = (total - previous["wall_seconds"]["total"]) / previous["wall_seconds"]["total"] * 100
+        line += f"  vs {previous.get('revision')}: {change:+.1f}%"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--patients", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--delay", type=float, default=0.0, help="задержка ответа stub сервера в секундах")
+    parser.add_argument("--results", default=DEFAULT_RESULTS_PATH, help="файл JSON Lines с историей прогонов")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--sheet", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        serve(args.serve, sheet_path=args.sheet, delay=args.delay)
+        return
+
+    if args.single is not None:
+        logging.disable(logging.INFO)
+        print(json.dumps(run_single(args.single, base_url=args.base_url, sheet_path=args.sheet)))
+        return
+
+    previous_results = load_previous_results(args.results)
+    revision = get_revision()
+    results = []
+    for patients in args.patients:
+        result = run_benchmark(patients, delay=args.delay)
+        result["revision"] = revision
+        result["created_at"] = datetime.now().isoformat(timespec="seconds")
+        print_result(result, previous_results.get(patients))
+        results.append(result)
+
+    os.makedirs(os.path.dirname(args.results) or ".", exist_ok=True)
+    with open(args.results, "a", encoding="utf-8") as file:
+        for result in results:
+            file.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
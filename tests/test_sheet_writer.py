@@ -0,0 +1,133 @@
+import unittest
+
+from app.excel import GoogleSheetsClient
+from app.patient_index import PatientCodeIndex
+from app.sheet_writer import SheetWritePlanner
+from app.worksheets import MemoryWorksheet
+
+CODE_COL = 4
+HEADER = [["", "", "ФИО", "Код", "Визиты"], ["", "", "", "", ""]]
+
+
+def patient_row(code: int, visits: int | str = "") -> list:
+    return ["", "", f"Пациент {code}", str(code), str(visits)]
+
+
+class SheetWritePlannerTest(unittest.TestCase):
+    def setUp(self):
+        self.worksheet = MemoryWorksheet(HEADER + [patient_row(code, 1) for code in (10, 20, 30, 40)])
+        self.client = GoogleSheetsClient(
+            google_sheets_key="test",
+            worksheet_name=f"test-{self.id()}",
+            token_path="",
+            max_requests=1000,
+            burst=100,
+            worksheet=self.worksheet,
+        )
+        self.client.load_snapshot()
+        self.index = PatientCodeIndex(self.client.get_column_values(CODE_COL))
+        self.planner = SheetWritePlanner(google_sheet_client=self.client)
+
+    def insert_patient(self, code: int, visits: int | str = "") -> int:
+        before_row = self.index.get_insert_row(code)
+        row = self.planner.insert_row(patient_row(code), before_row=before_row, order=code)
+        self.index.add(code, row=row, insert_row=before_row)
+        self.planner.add([(row, 5, visits)])
+        return row
+
+    def update_visits(self, code: int, visits: int):
+        self.planner.add([(self.index.find_row(code), 5, visits)])
+
+    def sheet_rows(self) -> list[tuple[str, str]]:
+        return [(row[3], row[4]) for row in self.worksheet.values[len(HEADER) :]]
+
+    def test_inserts_new_codes_in_order_and_moves_updates(self):
+        # Планирование идет не по порядку кодов, а изменения существующих строк перемешаны со вставками
+        self.insert_patient(35, visits=3)
+        self.update_visits(40, 4)
+        self.insert_patient(5, visits=1)
+        self.insert_patient(25, visits=2)
+        self.update_visits(20, 7)
+        self.insert_patient(50, visits=5)
+        self.insert_patient(32, visits=9)
+        self.insert_patient(45)
+        self.update_visits(10, 8)
+
+        self.planner.flush()
+
+        self.assertEqual(
+            self.sheet_rows(),
+            [
+                ("5", "1"),
+                ("10", "8"),
+                ("20", "7"),
+                ("25", "2"),
+                ("30", "1"),
+                ("32", "9"),
+                ("35", "3"),
+                ("40", "4"),
+                ("45", ""),
+                ("50", "5"),
+            ],
+        )
+        # ФИО записано в той же строке, что и код
+        for row in self.worksheet.values[len(HEADER) :]:
+            self.assertEqual(row[2], f"Пациент {row[3]}")
+
+    def test_flush_uses_one_insert_and_one_values_request(self):
+        for code in (15, 25, 35, 45, 55):
+            self.insert_patient(code, visits=code)
+        self.update_visits(30, 2)
+
+        self.assertEqual(self.planner.flush(), 2)
+        self.assertEqual(self.worksheet.calls["spreadsheet_batch_update"], 1)
+        self.assertEqual(self.worksheet.calls["batch_update"], 1)
+        self.assertEqual(self.worksheet.calls["insert_rows"], 0)
+
+    def test_snapshot_matches_sheet_after_flush(self):
+        self.insert_patient(15, visits=2)
+        self.insert_patient(60, visits=6)
+        self.update_visits(40, 4)
+
+        self.planner.flush()
+
+        self.assertEqual(self.client.snapshot.values, self.worksheet.get_all_values())
+        index = PatientCodeIndex(self.client.get_column_values(CODE_COL))
+        self.assertEqual(index.find_row(15), 4)
+        self.assertEqual(index.find_row(40), 7)
+        self.assertEqual(index.find_row(60), 8)
+
+    def test_unchanged_cells_are_not_written(self):
+        self.update_visits(20, 1)
+
+        self.assertEqual(self.planner.flush(), 0)
+        self.assertEqual(self.worksheet.calls["batch_update"], 0)
+
+
+class PatientCodeIndexTest(unittest.TestCase):
+    def test_find_and_insert_rows(self):
+        index = PatientCodeIndex(["ФИО", "", "10", "abc", "30", " 20 "])
+
+        self.assertEqual(index.find_row(20), 6)
+        self.assertIsNone(index.find_row(15))
+        # Сразу за ближайшим меньшим кодом, перед самым маленьким или в конец пустого индекса
+        self.assertEqual(index.get_insert_row(15), 4)
+        self.assertEqual(index.get_insert_row(25), 7)
+        self.assertEqual(index.get_insert_row(40), 6)
+        self.assertEqual(index.get_insert_row(5), 3)
+        self.assertEqual(PatientCodeIndex(["ФИО"]).get_insert_row(1), 2)
+
+    def test_added_codes_share_the_insert_row(self):
+        index = PatientCodeIndex(["10", "20"])
+
+        index.add(12, row=100, insert_row=index.get_insert_row(12))
+        index.add(11, row=101, insert_row=index.get_insert_row(11))
+
+        self.assertEqual(index.get_insert_row(11), 2)
+        self.assertEqual(index.get_insert_row(13), 2)
+        self.assertEqual(index.get_insert_row(25), 3)
+        self.assertEqual(index.find_row(12), 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
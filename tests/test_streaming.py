@@ -0,0 +1,48 @@
+import json
+import unittest
+
+from app.clinics_card.streaming import iter_json_array
+
+
+def split_chunks(text: str, size: int) -> list[bytes]:
+    data = text.encode()
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+class IterJsonArrayTest(unittest.TestCase):
+    def test_numbers_split_at_chunk_boundary(self):
+        for chunks in (
+            [b'{"data":[1', b"2]}"],
+            [b'{"data":[1.', b"5]}"],
+            [b'{"data":[1e', b"5]}"],
+            [b'{"data":[1.5e', b"-3]}"],
+            [b'{"data":[-', b"7]}"],
+        ):
+            with self.subTest(chunks=chunks):
+                self.assertEqual(list(iter_json_array(chunks)), json.loads(b"".join(chunks))["data"])
+
+    def test_every_chunk_size(self):
+        payload = {
+            "meta": {"total": 3, "pages": [1, 2]},
+            "data": [
+                {"id": "1", "amount": 12.5, "rate": 1e-3, "name": "Иван", "active": True, "note": None},
+                {"id": "2", "amount": -40, "rate": 2.5e10, "name": 'Петр "Первый"', "active": False, "note": "a"},
+                [],
+                0,
+            ],
+        }
+        text = json.dumps(payload, ensure_ascii=False)
+        for size in range(1, len(text.encode()) + 1):
+            with self.subTest(size=size):
+                self.assertEqual(list(iter_json_array(split_chunks(text, size))), payload["data"])
+
+    def test_empty_array(self):
+        self.assertEqual(list(iter_json_array([b'{"data": [ ]}'])), [])
+
+    def test_missing_key(self):
+        with self.assertRaises(KeyError):
+            list(iter_json_array([b'{"items": [1, 2]}']))
+
+
+if __name__ == "__main__":
+    unittest.main()